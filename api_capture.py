@@ -0,0 +1,225 @@
+import argparse
+import atexit
+import bisect
+import gzip
+import json
+import threading
+import time
+
+from junction_runtime import JunctionRuntime, load_junction_configs
+from maps_client import set_client
+from road_cache import RoadCache, set_cache
+from signal_controller import Scheduler, SimulationClock
+
+
+# Records are buffered by gzip and flushed to disk every this many records.
+FLUSH_EVERY = 50
+
+
+def request_key(endpoint, params):
+    """Identify a request by endpoint and parameters, ignoring the API key."""
+    params = {name: str(value) for name, value in (params or {}).items() if name != 'key'}
+    return endpoint + "?" + json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+
+class CaptureLog:
+    """
+    Append-only, gzip-compressed JSON-lines log of API responses.
+    Each record holds the wall-clock time "t", endpoint "e", request parameters "p"
+    (without the API key), status "s", latency "l" and decoded body "b".
+    Enable it for the shared client by setting ITMS_CAPTURE_PATH.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, "at", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.pending = 0
+        atexit.register(self.close)
+
+    def record(self, endpoint, params, response, latency):
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        line = json.dumps({
+            "t": time.time(),
+            "e": endpoint,
+            "p": {name: value for name, value in (params or {}).items() if name != 'key'},
+            "s": response.status_code,
+            "l": round(latency, 4),
+            "b": body,
+        }, separators=(',', ':'))
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(line + "\n")
+            self.pending += 1
+            if self.pending >= FLUSH_EVERY:
+                self.file.flush()
+                self.pending = 0
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def read_capture(path):
+    """Yield the records of a capture log in the order they were written."""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class ReplayResponse:
+    """Minimal stand-in for requests.Response built from a capture record."""
+
+    def __init__(self, record):
+        self.status_code = record["s"]
+        self._body = record["b"]
+
+    def json(self):
+        if isinstance(self._body, str):
+            return json.loads(self._body)
+        return self._body
+
+    @property
+    def text(self):
+        return self._body if isinstance(self._body, str) else json.dumps(self._body)
+
+
+class ReplayClient:
+    """
+    Drop-in replacement for MapsClient that answers from a capture log, with no network.
+    Without a clock, repeated requests get their captured responses in order (full speed).
+    With a clock, such as a SimulationClock driving a Scheduler, each request gets the
+    response that was current at the same offset into the capture, so a scaled clock
+    replays the day as it happened.
+    Distance Matrix responses are also indexed cell by cell, so batches that group the
+    approaches differently from the capture (e.g. incremental polling) can still be answered.
+    """
+
+    def __init__(self, records, clock=None):
+        self.responses = {}
+        self.cells = {}
+        for record in sorted(records, key=lambda record: record["t"]):
+            self.responses.setdefault(request_key(record["e"], record["p"]), []).append(record)
+            if record["e"] == "distancematrix" and record["s"] == 200 and isinstance(record["b"], dict):
+                self._index_cells(record)
+        self.times = {key: [record["t"] for record in entries] for key, entries in self.responses.items()}
+        self.cell_times = {cell: [t for t, _ in entries] for cell, entries in self.cells.items()}
+        self.capture_start = min((times[0] for times in self.times.values()), default=0.0)
+        self.capture_end = max((times[-1] for times in self.times.values()), default=0.0)
+        self.clock = clock
+        self.clock_start = clock() if clock is not None else None
+        self.positions = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, clock=None):
+        return cls(read_capture(path), clock)
+
+    def _index_cells(self, record):
+        origins = record["p"].get("origins", "").split("|")
+        destinations = record["p"].get("destinations", "").split("|")
+        for i, row in enumerate(record["b"].get("rows", [])):
+            for j, element in enumerate(row.get("elements", [])):
+                if i < len(origins) and j < len(destinations):
+                    self.cells.setdefault((origins[i], destinations[j]), []).append((record["t"], element))
+
+    def _pick(self, times, entries, key):
+        """Choose the entry to replay: the next one in order, or the one current at the clock's offset."""
+        if self.clock is None:
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+            return entries[min(position, len(entries) - 1)]
+        capture_time = self.capture_start + (self.clock() - self.clock_start)
+        return entries[max(0, bisect.bisect_right(times, capture_time) - 1)]
+
+    def _distance_matrix_from_cells(self, params):
+        origins = str(params.get("origins", "")).split("|")
+        destinations = str(params.get("destinations", "")).split("|")
+        rows = []
+        found = False
+        for origin in origins:
+            elements = []
+            for destination in destinations:
+                cell = (origin, destination)
+                if cell in self.cells:
+                    found = True
+                    elements.append(self._pick(self.cell_times[cell], self.cells[cell], cell)[1])
+                else:
+                    elements.append({"status": "NOT_FOUND"})
+            rows.append({"elements": elements})
+        if not found:
+            return None
+        return ReplayResponse({"s": 200, "b": {"status": "OK", "rows": rows}})
+
+    @property
+    def duration(self):
+        return self.capture_end - self.capture_start
+
+    def get(self, endpoint, params=None):
+        key = request_key(endpoint, params)
+        with self.lock:
+            entries = self.responses.get(key)
+            if entries:
+                self.hits += 1
+                return ReplayResponse(self._pick(self.times[key], entries, key))
+            if endpoint == "distancematrix":
+                response = self._distance_matrix_from_cells(params or {})
+                if response is not None:
+                    self.hits += 1
+                    return response
+            self.misses += 1
+            return None
+
+    def get_stats(self):
+        return {"hits": self.hits, "misses": self.misses, "requests": sum(map(len, self.responses.values()))}
+
+
+def replay(capture_path, configs, hours=None, speed=None):
+    """
+    Run the junctions in `configs` against a capture log on a SimulationClock.
+    Replays the whole capture (or `hours` of it) as fast as possible, or at `speed`
+    times real time. Returns the runtime so its controllers can be inspected.
+    Lookups go through an empty in-memory cache, as they did while capturing, so the replay
+    neither depends on nor writes to the persistent road cache.
+    """
+    clock = SimulationClock()
+    client = ReplayClient.from_file(capture_path, clock)
+    set_client(client)
+    set_cache(RoadCache(":memory:"))
+
+    scheduler = Scheduler(clock=clock)
+    runtime = JunctionRuntime("replay", scheduler=scheduler, background_refresh=False, verbose=False)
+    runtime.setup(configs)
+    runtime.start()
+    duration = hours * 3600 if hours is not None else client.duration
+    started = time.perf_counter()
+    scheduler.run_until(clock() + duration, speed=speed)
+    elapsed = time.perf_counter() - started
+
+    cycles = sum(junction.controller.cycle_count for junction in runtime.junctions)
+    stats = client.get_stats()
+    print(f"Replayed {duration / 3600:.2f} h of {len(runtime.junctions)} junctions in {elapsed:.2f} s: "
+          f"{cycles} cycles, {stats['hits']} responses replayed, {stats['misses']} requests not in the capture")
+    return runtime
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured API log through the junction controllers.")
+    parser.add_argument("capture", help="capture log written with ITMS_CAPTURE_PATH")
+    parser.add_argument("config", help="JSON junction config")
+    parser.add_argument("--hours", type=float, help="hours to replay (default: the whole capture)")
+    parser.add_argument("--speed", type=float, help="replay at this multiple of real time (default: full speed)")
+    args = parser.parse_args()
+    replay(args.capture, load_junction_configs(args.config), args.hours, args.speed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import math
+import time
+
+from data_sources import ForecastingSource, SimulatedJunction
+from intensity_tracker import IntensityTracker
+from phase_timing import TIMING_ENGINES, make_timing
+from signal_controller import JunctionController, Scheduler, SimulationClock
+
+
+def rush_hour_profile(t):
+    """Demand doubles in a one hour peak every three hours."""
+    return 2.0 if (t // 3600) % 3 == 1 else 1.0
+
+
+def sinusoidal_profile(t):
+    """Demand swings smoothly between 50% and 150% with a two hour period."""
+    return 1.0 + 0.5 * math.sin(2 * math.pi * t / 7200)
+
+
+# Arrival rates are vehicles per second on each approach.
+SCENARIOS = [
+    {"name": "balanced-4", "arrival_rates": [0.08, 0.08, 0.08, 0.08], "life_cycle_seconds": 120},
+    {"name": "dominant-main-road", "arrival_rates": [0.15, 0.04, 0.13, 0.03], "life_cycle_seconds": 120},
+    {"name": "near-tie", "arrival_rates": [0.11, 0.10, 0.10, 0.09], "life_cycle_seconds": 120},
+    {"name": "three-way", "arrival_rates": [0.12, 0.07, 0.07], "life_cycle_seconds": 90},
+    {"name": "six-way-peak", "arrival_rates": [0.06, 0.05, 0.07, 0.04, 0.06, 0.05],
+     "life_cycle_seconds": 150, "demand_profile": rush_hour_profile},
+    {"name": "sinusoidal", "arrival_rates": [0.10, 0.06, 0.09, 0.05], "life_cycle_seconds": 120,
+     "demand_profile": sinusoidal_profile},
+]
+
+
+def run_scenario(scenario, hours=1.0, junctions=1, seed=0, incremental=False, forecast=False, **controller_options):
+    """
+    Run a scenario on a SimulationClock, faster than real time, and return its metrics:
+    average delay per vehicle (s), average queue (vehicles per junction), throughput
+    (vehicles/hour per junction), approaches polled per cycle and controller CPU time per cycle (ms).
+    With `incremental` every controller polls through an IntensityTracker, and with `forecast`
+    it plans on a ForecastingSource forecast of the next cycle instead of the last sample.
+    """
+    clock = SimulationClock()
+    scheduler = Scheduler(clock=clock)
+    simulations = []
+    controllers = []
+    for j in range(junctions):
+        simulation = SimulatedJunction(scenario["arrival_rates"], clock,
+                                       demand_profile=scenario.get("demand_profile"), seed=seed + j)
+        road_names = [f"Approach {i + 1}" for i in range(len(scenario["arrival_rates"]))]
+        intensities = simulation.fetch_intensities()
+        tracker = IntensityTracker(intensities) if incremental else None
+        fetch_intensities = simulation.fetch_intensities
+        if forecast:
+            fetch_intensities = ForecastingSource(simulation, len(road_names), clock=clock,
+                                                  horizon_seconds=scenario["life_cycle_seconds"] / 2,
+                                                  asynchronous=False).fetch_intensities
+        controller = JunctionController(f"{scenario['name']}-{j}", road_names, scheduler,
+                                        fetch_intensities, scenario["life_cycle_seconds"],
+                                        intensities=intensities, tracker=tracker,
+                                        background_refresh=False, verbose=False, **controller_options)
+        controller.subscribe(simulation)
+        controller.start()
+        simulations.append(simulation)
+        controllers.append(controller)
+
+    started = time.process_time()
+    scheduler.run_until(hours * 3600)
+    total_cpu = time.process_time() - started
+
+    simulation_cpu = sum(simulation.cpu_time for simulation in simulations)
+    cycles = sum(controller.cycle_count for controller in controllers)
+    polls = sum(simulation.polls for simulation in simulations)
+    stats = [simulation.get_stats() for simulation in simulations]
+    arrived = sum(simulation.arrived for simulation in simulations)
+    return {
+        "scenario": scenario["name"],
+        "cycles": cycles,
+        "average_delay": sum(simulation.queue_integral for simulation in simulations) / arrived if arrived else 0.0,
+        "average_queue": sum(s["average_queue"] for s in stats) / len(stats),
+        "throughput": sum(s["throughput"] for s in stats) / len(stats),
+        "polls_per_cycle": polls / cycles if cycles else 0.0,
+        "cpu_ms_per_cycle": (total_cpu - simulation_cpu) * 1000 / cycles if cycles else 0.0,
+    }
+
+
+def print_results(results):
+    print(f"{'Scenario':<22}{'Cycles':>8}{'Delay (s)':>12}{'Queue (veh)':>13}{'Veh/hour':>11}"
+          f"{'Polls/cycle':>13}{'CPU ms/cycle':>14}")
+    for result in results:
+        print(f"{result['scenario']:<22}{result['cycles']:>8}{result['average_delay']:>12.1f}"
+              f"{result['average_queue']:>13.1f}{result['throughput']:>11.0f}{result['polls_per_cycle']:>13.2f}"
+              f"{result['cpu_ms_per_cycle']:>14.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the signal controller against simulated traffic.")
+    parser.add_argument("--hours", type=float, default=6.0, help="simulated hours per scenario")
+    parser.add_argument("--junctions", type=int, default=1, help="simulated junctions per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenario", action="append", help="only run the named scenario(s)")
+    parser.add_argument("--timing", action="append", choices=list(TIMING_ENGINES),
+                        help="phase timing engine(s) to compare (default: all)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="poll through an IntensityTracker instead of refreshing every approach each cycle")
+    parser.add_argument("--forecast", action="store_true",
+                        help="plan on a short-term forecast of the next cycle instead of the last sample")
+    args = parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or s["name"] in args.scenario]
+    for timing_name in args.timing or list(TIMING_ENGINES):
+        print(f"\nPhase timing: {timing_name}")
+        results = [run_scenario(scenario, args.hours, args.junctions, args.seed, args.incremental, args.forecast,
+                                timing=make_timing(timing_name))
+                   for scenario in scenarios]
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
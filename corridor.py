@@ -0,0 +1,136 @@
+import math
+
+import numpy as np
+
+
+# Progression speed used for the green wave when a corridor does not set its own.
+DEFAULT_CORRIDOR_SPEED_KMH = 30
+METERS_PER_DEGREE = 111320
+
+
+def local_coordinates(latitudes, longitudes):
+    """Project coordinates onto a flat north/east plane (metres) centred on their mean."""
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    latitude_0 = latitudes.mean()
+    north_m = (latitudes - latitude_0) * METERS_PER_DEGREE
+    east_m = (longitudes - longitudes.mean()) * METERS_PER_DEGREE * math.cos(math.radians(latitude_0))
+    return north_m, east_m
+
+
+def order_along_corridor(latitudes, longitudes):
+    """
+    Order junctions along the corridor by projecting them onto its principal axis.
+    Returns the junction indices from one end of the corridor to the other.
+    """
+    north_m, east_m = local_coordinates(latitudes, longitudes)
+    if len(north_m) < 2:
+        return np.arange(len(north_m))
+    points = np.column_stack((north_m, east_m))
+    _, _, axes = np.linalg.svd(points - points.mean(axis=0), full_matrices=False)
+    return np.argsort(points @ axes[0], kind='stable')
+
+
+def link_distances(latitudes, longitudes, order):
+    """Straight-line distance (m) between consecutive junctions in `order`."""
+    north_m, east_m = local_coordinates(latitudes, longitudes)
+    order = np.asarray(order)
+    return np.hypot(np.diff(north_m[order]), np.diff(east_m[order]))
+
+
+def green_wave_offsets(distances_m, speeds_mps, cycle_seconds):
+    """
+    One-way green wave: the offset (s) of every junction along the corridor is the travel time
+    from the first junction, modulo the common cycle. `speeds_mps` is one speed or one per link.
+    """
+    travel_times = np.asarray(distances_m, dtype=float) / np.asarray(speeds_mps, dtype=float)
+    arrival_times = np.concatenate(([0.0], np.cumsum(travel_times)))
+    return np.mod(arrival_times, cycle_seconds)
+
+
+def approach_bearings(latitude, longitude, coordinates):
+    """Bearing (degrees from north) of every approach, given as (latitude, longitude) rows, from the junction centre."""
+    coords = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    north_m = (coords[:, 0] - latitude) * METERS_PER_DEGREE
+    east_m = (coords[:, 1] - longitude) * METERS_PER_DEGREE * math.cos(math.radians(latitude))
+    return np.degrees(np.arctan2(east_m, north_m)) % 360
+
+
+def upstream_bearings(latitudes, longitudes, order):
+    """
+    Bearing from every junction (in `order`) towards the junction the wave arrives from.
+    The first junction has no upstream neighbour, so it faces away from the second one.
+    """
+    north_m, east_m = local_coordinates(latitudes, longitudes)
+    order = np.asarray(order)
+    d_north = np.diff(north_m[order])
+    d_east = np.diff(east_m[order])
+    # Bearing of each link from its downstream end back to its upstream end.
+    back = np.degrees(np.arctan2(-d_east, -d_north)) % 360
+    return np.concatenate(([back[0]], back)) if len(back) else np.zeros(len(order))
+
+
+def closest_bearing(bearings, target):
+    """Index of the bearing with the smallest angular difference to `target`."""
+    difference = np.abs((np.asarray(bearings) - target + 180) % 360 - 180)
+    return int(np.argmin(difference))
+
+
+class CorridorCoordinator:
+    """
+    Coordinates the junctions of one corridor into a green wave.
+    Junctions are ordered along the corridor, every junction's inbound approach (the one facing
+    the previous junction) is chosen as its coordinated phase, and on every corridor cycle the
+    offsets are re-solved from the junction spacing and the progression speed. The common cycle
+    is the longest natural cycle of the member controllers; shorter members stretch their greens
+    to fill it and hold their cycle starts so the coordinated approaches turn green at their offsets.
+    """
+
+    def __init__(self, name, junctions, scheduler, speed_kmh=DEFAULT_CORRIDOR_SPEED_KMH, verbose=True):
+        self.name = name
+        self.scheduler = scheduler
+        self.speed_mps = speed_kmh / 3.6
+        self.verbose = verbose
+        latitudes = [junction.config.latitude for junction in junctions]
+        longitudes = [junction.config.longitude for junction in junctions]
+        self.order = order_along_corridor(latitudes, longitudes)
+        self.junctions = [junctions[i] for i in self.order]
+        self.distances_m = link_distances(latitudes, longitudes, self.order)
+        self.coordinated_roads = [
+            closest_bearing(approach_bearings(junction.config.latitude, junction.config.longitude,
+                                              junction.coordinates), bearing)
+            for junction, bearing in zip(self.junctions, upstream_bearings(latitudes, longitudes, self.order))
+        ]
+        self.cycle_seconds = None
+        self.offsets = None
+        self.reference_time = None
+        self.running = False
+
+    def solve(self):
+        """Recompute the common cycle and offsets and hand them to the controllers."""
+        self.cycle_seconds = max(junction.controller.natural_cycle_seconds() for junction in self.junctions)
+        self.offsets = green_wave_offsets(self.distances_m, self.speed_mps, self.cycle_seconds)
+        for junction, road_index, offset in zip(self.junctions, self.coordinated_roads, self.offsets.tolist()):
+            junction.controller.coordinate(self.cycle_seconds, offset, road_index, self.reference_time)
+        return self.offsets
+
+    def start(self):
+        self.running = True
+        self.reference_time = self.scheduler.now()
+        self.solve()
+        if self.verbose:
+            links = ", ".join(f"{junction.config.name} +{offset:.0f}s"
+                              for junction, offset in zip(self.junctions, self.offsets.tolist()))
+            print(f"Corridor {self.name}: {self.cycle_seconds:.0f} s cycle, offsets {links}")
+        self.scheduler.call_at(self.reference_time + self.cycle_seconds, self._tick)
+
+    def _tick(self):
+        if not self.running:
+            return
+        self.solve()
+        self.scheduler.call_later(self.cycle_seconds, self._tick)
+
+    def stop(self):
+        self.running = False
+        for junction in self.junctions:
+            junction.controller.coordinate(None)
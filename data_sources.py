@@ -0,0 +1,218 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from forecasting import IntensityForecaster
+from maps_api import CONGESTION_SCALE, INTENSITY_FETCH_DEADLINE, fetch_traffic_intensities
+
+
+class TrafficDataSource(ABC):
+    """
+    Supplies per-approach traffic intensities to a JunctionController.
+    Pass `source.fetch_intensities` as the controller's `fetch_intensities` callback.
+    When `indices` is given only those approaches are polled; the others keep their previous value.
+    """
+
+    @abstractmethod
+    def fetch_intensities(self, previous_intensities=None, indices=None):
+        """Return the intensity of every approach, polling only `indices` if given."""
+
+
+class GoogleMapsSource(TrafficDataSource):
+    """
+    Live intensities from the Distance Matrix API for the approaches of one junction.
+    `coordinates` holds the (latitude, longitude) of every approach, e.g. snapped_coordinates(snapped_points)
+    or a row range of an ApproachTable, which is used as is rather than copied. Every approach is timed
+    to `destination`, the junction's configured centre, also when only some are polled.
+    """
+
+    def __init__(self, coordinates, api_key, destination, deadline=INTENSITY_FETCH_DEADLINE):
+        self.coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        self.api_key = api_key
+        self.deadline = deadline
+        self.destination = (float(destination[0]), float(destination[1]))
+
+    def fetch_intensities(self, previous_intensities=None, indices=None):
+        if indices is None:
+            return fetch_traffic_intensities(self.coordinates, [self.destination] * len(self.coordinates),
+                                             self.api_key, previous_intensities, deadline=self.deadline)
+        if previous_intensities is None:
+            previous_intensities = [0] * len(self.coordinates)
+        intensities = list(previous_intensities)
+        fresh = fetch_traffic_intensities(self.coordinates[indices], [self.destination] * len(indices), self.api_key,
+                                          [intensities[i] for i in indices], deadline=self.deadline)
+        for i, intensity in zip(indices, fresh):
+            intensities[i] = intensity
+        return intensities
+
+
+# How far ahead (seconds) the forecast looks: roughly the middle of the next cycle.
+FORECAST_HORIZON_SECONDS = 60
+
+
+class ForecastingSource(TrafficDataSource):
+    """
+    Wraps another source so the controller gets a forecast of the next cycle's intensities at once.
+    Each call returns IntensityForecaster.predict() for `horizon_seconds` ahead and polls the wrapped
+    source for the requested approaches; with `asynchronous` the poll runs on its own thread and its
+    values correct the forecast whenever they arrive, so API latency never holds up the signal plan.
+    Until every approach has a live sample the poll is made inline.
+    An approach whose latest poll failed is returned as its previous value (None when the controller
+    has a fallback) rather than forecast, so the fallback takes over as it does for a live source.
+    take_samples() hands the live values to the controller for its CycleEvent, as `samples`.
+    `clock` must be wall-clock-like (time.time, or a SimulationClock starting at midnight) for the
+    time-of-day profile; `utc_offset` defaults to the local timezone when the clock is time.time.
+    """
+
+    def __init__(self, source, count, clock=time.time, horizon_seconds=FORECAST_HORIZON_SECONDS,
+                 asynchronous=True, utc_offset=None, **forecaster_options):
+        if utc_offset is None:
+            utc_offset = time.localtime().tm_gmtoff if clock is time.time else 0
+        self.source = source
+        self.clock = clock
+        self.horizon_seconds = horizon_seconds
+        self.asynchronous = asynchronous
+        self.forecaster = IntensityForecaster(count, utc_offset=utc_offset, **forecaster_options)
+        self.previous = [0] * count
+        self.poll_thread = None
+        self.skipped_polls = 0
+        self.failed = [False] * count
+        # Live samples ({road_index: intensity or None}) that arrived since the last take_samples().
+        self.samples = {}
+        self.missed_poll = False
+        self.lock = threading.Lock()
+
+    def _poll(self, previous_intensities, indices):
+        polled = range(len(self.previous)) if indices is None else indices
+        try:
+            intensities = self.source.fetch_intensities(previous_intensities, indices)
+        except Exception as e:
+            print(f"Error polling traffic data for the forecast: {e}")
+            intensities = [None] * len(self.previous)
+        self.forecaster.observe(self.clock(), polled, [intensities[i] for i in polled])
+        with self.lock:
+            for i in polled:
+                self.samples[i] = intensities[i]
+                self.failed[i] = intensities[i] is None
+                # Approaches that failed to answer (None) keep their last live value.
+                if intensities[i] is not None:
+                    self.previous[i] = intensities[i]
+
+    def take_samples(self):
+        """
+        The live samples that arrived since the last call, and whether a poll was skipped because
+        the previous one was still in flight.
+        """
+        with self.lock:
+            samples, missed = self.samples, self.missed_poll
+            self.samples = {}
+            self.missed_poll = False
+        return samples, missed
+
+    def fetch_intensities(self, previous_intensities=None, indices=None):
+        previous_intensities = list(previous_intensities) if previous_intensities is not None else self.previous
+        if self.asynchronous and self.forecaster.ready:
+            if self.poll_thread is not None and self.poll_thread.is_alive():
+                # The last poll is still in flight; its values will correct the next forecast.
+                self.skipped_polls += 1
+                with self.lock:
+                    self.missed_poll = True
+            else:
+                self.poll_thread = threading.Thread(target=self._poll, args=(previous_intensities, indices),
+                                                    daemon=True)
+                self.poll_thread.start()
+        else:
+            self._poll(previous_intensities, None if not self.forecaster.ready else indices)
+        forecast = self.forecaster.predict(self.clock() + self.horizon_seconds)
+        with self.lock:
+            failed = list(self.failed)
+        # Like a live source, a failed approach comes back as its previous value (None with a fallback).
+        return [previous_intensities[i] if failed[i] else int(round(value))
+                for i, value in enumerate(forecast.tolist())]
+
+
+# Vehicles per second discharged from a queue on green; yellow runs at half that rate.
+SATURATION_FLOW = 0.5
+# Free-flow travel time in seconds, plus the extra seconds each queued vehicle adds; simulated
+# intensities are their ratio scaled like the Distance Matrix congestion index (100 is free flow).
+BASE_TRAVEL_SECONDS = 10
+DELAY_PER_QUEUED_VEHICLE = 2.0
+
+
+class SimulatedJunction(TrafficDataSource):
+    """
+    Local traffic model for one junction, used instead of the Google APIs.
+    Vehicles arrive on every approach as a Poisson process with the given rates (vehicles/second),
+    optionally scaled over time by `demand_profile(t)`, and queue until their approach is green.
+    Subscribe it to the junction's controller so it sees the phase changes.
+    """
+
+    def __init__(self, arrival_rates, clock, saturation_flow=SATURATION_FLOW, demand_profile=None, seed=None):
+        self.arrival_rates = np.asarray(arrival_rates, dtype=float)
+        self.clock = clock
+        self.saturation_flow = saturation_flow
+        self.demand_profile = demand_profile
+        self.rng = np.random.default_rng(seed)
+        self.queues = np.zeros(len(self.arrival_rates))
+        self.service_rates = np.zeros(len(self.arrival_rates))
+        self.last_update = clock()
+        self.start_time = self.last_update
+        self.arrived = 0.0
+        self.departed = 0.0
+        self.queue_integral = 0.0  # vehicle-seconds spent waiting
+        self.cpu_time = 0.0
+        self.polls = 0
+
+    def _advance(self, now):
+        dt = now - self.last_update
+        if dt <= 0:
+            return
+        rates = self.arrival_rates
+        if self.demand_profile is not None:
+            rates = rates * self.demand_profile(self.last_update)
+        arrivals = self.rng.poisson(rates * dt)
+        departures = np.minimum(self.queues + arrivals, self.service_rates * dt)
+        new_queues = self.queues + arrivals - departures
+        # Trapezoidal estimate of the waiting time accumulated over the step.
+        self.queue_integral += float((self.queues + new_queues).sum()) * dt / 2
+        self.queues = new_queues
+        self.arrived += float(arrivals.sum())
+        self.departed += float(departures.sum())
+        self.last_update = now
+
+    def __call__(self, event):
+        """Phase event observer: start or stop discharging the approach's queue."""
+        started = time.process_time()
+        self._advance(event.actual_time)
+        if event.color == "green":
+            self.service_rates[event.road_index] = self.saturation_flow
+        elif event.color == "yellow":
+            self.service_rates[event.road_index] = self.saturation_flow / 2
+        else:
+            self.service_rates[event.road_index] = 0
+        self.cpu_time += time.process_time() - started
+
+    def fetch_intensities(self, previous_intensities=None, indices=None):
+        started = time.process_time()
+        self._advance(self.clock())
+        # Whole seconds, as the Distance Matrix reports them.
+        travel_seconds = (BASE_TRAVEL_SECONDS + DELAY_PER_QUEUED_VEHICLE * self.queues).round()
+        intensities = (CONGESTION_SCALE * travel_seconds / BASE_TRAVEL_SECONDS).round().astype(int).tolist()
+        if indices is not None and previous_intensities is not None:
+            polled = set(indices)
+            intensities = [intensity if i in polled else previous_intensities[i]
+                           for i, intensity in enumerate(intensities)]
+        self.polls += len(intensities) if indices is None else len(indices)
+        self.cpu_time += time.process_time() - started
+        return intensities
+
+    def get_stats(self):
+        """Average delay per vehicle (s), average total queue (vehicles) and throughput (vehicles/hour)."""
+        elapsed = self.last_update - self.start_time
+        return {
+            "average_delay": self.queue_integral / self.arrived if self.arrived else 0.0,
+            "average_queue": self.queue_integral / elapsed if elapsed else 0.0,
+            "throughput": self.departed * 3600 / elapsed if elapsed else 0.0,
+        }
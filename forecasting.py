@@ -0,0 +1,112 @@
+import threading
+
+import numpy as np
+
+
+DAY_SECONDS = 24 * 60 * 60
+# Width of a time-of-day profile bin.
+PROFILE_BIN_SECONDS = 15 * 60
+# Weight of a new sample in its profile bin and in the overall level.
+PROFILE_ALPHA = 0.2
+# Forgetting factor of the residual regression; older samples count for less.
+FORGETTING_FACTOR = 0.95
+
+
+class IntensityForecaster:
+    """
+    Short-term intensity forecast for a set of approaches.
+    Every approach learns a time-of-day profile (an exponentially weighted average per
+    `bin_seconds` bin, falling back to its overall level for bins it has not seen) and an
+    online AR(1) regression on the residual from that profile, fitted by recursive least
+    squares with forgetting. The forecast is the profile at the target time plus the learnt
+    share of the latest residual, so a live sample corrects the forecast as soon as it arrives.
+    All state is held in NumPy arrays, one row per approach.
+    """
+
+    def __init__(self, count, bin_seconds=PROFILE_BIN_SECONDS, alpha=PROFILE_ALPHA,
+                 forgetting_factor=FORGETTING_FACTOR, utc_offset=0):
+        self.bin_seconds = bin_seconds
+        self.alpha = alpha
+        self.forgetting_factor = forgetting_factor
+        self.utc_offset = utc_offset
+        bins = int(np.ceil(DAY_SECONDS / bin_seconds))
+        self.profile = np.zeros((count, bins))
+        self.profile_samples = np.zeros((count, bins), dtype=np.int32)
+        self.level = np.zeros(count)
+        self.samples = np.zeros(count, dtype=np.int64)
+        self.residual = np.zeros(count)
+        self.sxx = np.zeros(count)
+        self.sxy = np.zeros(count)
+        self.lock = threading.Lock()
+
+    def _bin(self, t):
+        return int(((t + self.utc_offset) % DAY_SECONDS) // self.bin_seconds)
+
+    def _baseline(self, indices, time_bin):
+        seen = self.profile_samples[indices, time_bin] > 0
+        return np.where(seen, self.profile[indices, time_bin], self.level[indices])
+
+    @property
+    def ready(self):
+        """True once every approach has at least one sample."""
+        return bool(self.samples.all())
+
+    @property
+    def coefficients(self):
+        """Share of the latest residual carried into the forecast, per approach (0 to 1)."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.clip(np.where(self.sxx > 0, self.sxy / self.sxx, 0.0), 0.0, 1.0)
+
+    def observe(self, t, indices, values):
+        """Fold live samples taken at time `t` into the model. Missing (None) values are skipped."""
+        pairs = [(i, value) for i, value in zip(indices, values) if value is not None]
+        if not pairs:
+            return
+        indices = np.array([i for i, _ in pairs])
+        values = np.array([value for _, value in pairs], dtype=float)
+        time_bin = self._bin(t)
+        with self.lock:
+            first = self.samples[indices] == 0
+            residual = np.where(first, 0.0, values - self._baseline(indices, time_bin))
+            # The regression pairs each residual with the previous one of the same approach.
+            previous = self.residual[indices]
+            known = ~first
+            self.sxx[indices] = np.where(known, self.forgetting_factor * self.sxx[indices] + previous ** 2,
+                                         self.sxx[indices])
+            self.sxy[indices] = np.where(known, self.forgetting_factor * self.sxy[indices] + previous * residual,
+                                         self.sxy[indices])
+            self.residual[indices] = residual
+
+            seen = self.profile_samples[indices, time_bin] > 0
+            current = self.profile[indices, time_bin]
+            self.profile[indices, time_bin] = np.where(seen, current + self.alpha * (values - current), values)
+            self.profile_samples[indices, time_bin] += 1
+            level = self.level[indices]
+            self.level[indices] = np.where(first, values, level + self.alpha * (values - level))
+            self.samples[indices] += 1
+
+    def predict(self, t):
+        """Forecast intensity of every approach at time `t`."""
+        with self.lock:
+            indices = np.arange(len(self.level))
+            forecast = self._baseline(indices, self._bin(t)) + self.coefficients * self.residual
+        return np.maximum(forecast, 0.0)
+
+    def history(self):
+        """Copies of the learnt per-approach arrays, one row per approach, for a snapshot."""
+        with self.lock:
+            return {"profile": self.profile.copy(), "profile_samples": self.profile_samples.copy(),
+                    "level": self.level.copy(), "samples": self.samples.copy(), "sxx": self.sxx.copy(),
+                    "sxy": self.sxy.copy()}
+
+    def load_history(self, history):
+        """Restore arrays returned by history(); they must cover the same approaches and bin width."""
+        if history["profile"].shape != self.profile.shape:
+            raise ValueError("Forecast history does not match this junction")
+        with self.lock:
+            self.profile = np.array(history["profile"], dtype=float)
+            self.profile_samples = np.array(history["profile_samples"], dtype=np.int32)
+            self.level = np.array(history["level"], dtype=float)
+            self.samples = np.array(history["samples"], dtype=np.int64)
+            self.sxx = np.array(history["sxx"], dtype=float)
+            self.sxy = np.array(history["sxy"], dtype=float)
@@ -0,0 +1,74 @@
+from junction_state import JunctionState
+
+
+SMOOTHING_ALPHA = 0.3
+# Relative change of a smoothed intensity that makes the controller recompute its plan.
+REPLAN_THRESHOLD = 0.1
+# Relative jump of a fresh sample that marks an approach as volatile.
+VOLATILITY_THRESHOLD = 0.05
+# A stable approach is polled at most once every this many cycles.
+MAX_POLL_INTERVAL = 8
+
+
+class IntensityTracker:
+    """
+    Incremental refresh state for one junction.
+    Keeps an exponentially smoothed intensity per approach and decides which approaches
+    are due for polling: volatile approaches every cycle, stable ones at an interval that
+    doubles up to `max_poll_interval` cycles. The plan only needs recomputing once a
+    smoothed intensity has moved more than `replan_threshold` since the last plan.
+    The smoothed intensities live in the `state` rows (a JunctionState) shared with the controller;
+    without one the tracker keeps its own. Pass `intensities=None` to start from the values already in `state`.
+    """
+
+    def __init__(self, intensities, alpha=SMOOTHING_ALPHA, replan_threshold=REPLAN_THRESHOLD,
+                 volatility_threshold=VOLATILITY_THRESHOLD, max_poll_interval=MAX_POLL_INTERVAL, state=None):
+        self.alpha = alpha
+        self.replan_threshold = replan_threshold
+        self.volatility_threshold = volatility_threshold
+        self.max_poll_interval = max_poll_interval
+        self.state = state if state is not None else JunctionState.standalone(len(intensities))
+        if intensities is not None:
+            self.smoothed[:] = [float(intensity or 0) for intensity in intensities]
+        self.planned = self.smoothed.tolist()
+        self.poll_intervals = [1] * len(self.planned)
+        self.next_poll = [0] * len(self.planned)
+        self.polls = 0
+
+    @property
+    def smoothed(self):
+        return self.state.smoothed
+
+    def due(self, cycle):
+        """Approach indices that should be polled in `cycle`."""
+        return [i for i, next_cycle in enumerate(self.next_poll) if next_cycle <= cycle]
+
+    def update(self, cycle, indices, intensities):
+        """Fold the fresh intensities of the polled `indices` into the smoothed values."""
+        smoothed = self.smoothed
+        for i in indices:
+            sample = intensities[i]
+            self.polls += 1
+            if sample is None:
+                self.next_poll[i] = cycle + 1
+                continue
+            previous = float(smoothed[i])
+            change = abs(sample - previous) / previous if previous else (1.0 if sample else 0.0)
+            smoothed[i] = previous + self.alpha * (sample - previous) if previous else float(sample)
+            if change > self.volatility_threshold:
+                self.poll_intervals[i] = 1
+            else:
+                self.poll_intervals[i] = min(self.poll_intervals[i] * 2, self.max_poll_interval)
+            self.next_poll[i] = cycle + self.poll_intervals[i]
+
+    def needs_replan(self):
+        for smoothed, planned in zip(self.smoothed.tolist(), self.planned):
+            if planned == 0:
+                if smoothed != 0:
+                    return True
+            elif abs(smoothed - planned) / planned > self.replan_threshold:
+                return True
+        return False
+
+    def mark_planned(self):
+        self.planned = self.smoothed.tolist()
@@ -0,0 +1,96 @@
+import argparse
+import os
+import signal
+
+from dotenv import load_dotenv
+
+from corridor import DEFAULT_CORRIDOR_SPEED_KMH
+from junction_runtime import JunctionRuntime, load_junction_configs
+from maps_client import BURST, RATE_LIMIT, get_client
+from metrics import METRICS_FILE, METRICS_PORT
+from phase_log import DEFAULT_MAX_SEGMENTS, SEGMENT_MAX_BYTES, PhaseLog
+from phase_timing import DEFAULT_TIMING, TIMING_ENGINES, make_timing
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the junction controllers headless from a config file, without the Tk form.")
+    parser.add_argument("config", help="JSON or YAML junction config")
+    parser.add_argument("--timing", choices=list(TIMING_ENGINES), default=DEFAULT_TIMING,
+                        help="phase timing engine")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="refresh every approach each cycle instead of polling incrementally")
+    parser.add_argument("--forecast", action="store_true",
+                        help="plan on a short-term forecast while live polls run in the background")
+    parser.add_argument("--corridor-speed", type=float, default=DEFAULT_CORRIDOR_SPEED_KMH,
+                        help="green-wave progression speed in km/h")
+    parser.add_argument("--snapshot",
+                        help="restore the junctions from this snapshot if it exists, and save it on exit")
+    parser.add_argument("--map", metavar="PATH", help="write a live HTML map overlay of the junctions to PATH")
+    parser.add_argument("--open-map", action="store_true", help="open the map in the browser")
+    parser.add_argument("--phase-log", metavar="DIR", help="append every phase change and intensity sample to DIR")
+    parser.add_argument("--phase-log-max-segments", type=int, default=DEFAULT_MAX_SEGMENTS, metavar="N",
+                        help=f"keep the newest N phase log segments of {SEGMENT_MAX_BYTES // 2 ** 20} MiB; "
+                             "0 keeps them all")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT,
+                        help="Google Maps requests per second across all endpoints")
+    parser.add_argument("--rate-burst", type=float, default=BURST, help="requests allowed in one burst")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="serve metrics on this port")
+    parser.add_argument("--metrics-file", default=METRICS_FILE, help="write metrics to this file periodically")
+    parser.add_argument("--check", action="store_true", help="set up the junctions and exit")
+    parser.add_argument("--quiet", action="store_true", help="do not print every phase change")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.phase_log_max_segments < 0:
+        raise SystemExit("--phase-log-max-segments must be 0 or more.")
+    load_dotenv()
+    api_key = os.getenv("API_KEY")
+    if not api_key:
+        raise SystemExit("API_KEY is not set; add it to the environment or a .env file.")
+    get_client().set_rate_limit(args.rate_limit, args.rate_burst)
+
+    runtime = JunctionRuntime(api_key, timing=make_timing(args.timing), incremental_refresh=not args.full_refresh,
+                              verbose=not args.quiet, corridor_speed_kmh=args.corridor_speed, forecast=args.forecast)
+    configs = load_junction_configs(args.config)
+    restored = None
+    if args.snapshot and os.path.exists(args.snapshot):
+        restored = runtime.restore(args.snapshot, configs)
+    if restored is None:
+        runtime.setup(configs)
+    if not runtime.junctions and not runtime.pending_discoveries:
+        raise SystemExit("No junctions could be set up.")
+
+    if args.map or args.open_map:
+        from map_export import MAP_FILE_NAME, MapOverlay
+        overlay = MapOverlay(args.map or MAP_FILE_NAME, api_key)
+        map_path = overlay.attach(runtime)
+        print(f"Map overlay written to {map_path}, refreshed every {overlay.refresh_seconds} seconds")
+        if args.open_map:
+            import webbrowser
+            webbrowser.open_new_tab(f"file://{map_path}")
+
+    if args.phase_log:
+        phase_log = PhaseLog(args.phase_log, max_segments=args.phase_log_max_segments or None)
+        runtime.subscribe(phase_log)
+        runtime.subscribe_cycles(phase_log.record_cycle)
+
+    if args.check:
+        if args.snapshot:
+            runtime.save_snapshot(args.snapshot)
+        return
+
+    # Stop cleanly on SIGTERM, as on Ctrl+C.
+    signal.signal(signal.SIGTERM, lambda signum, frame: runtime.scheduler.stop())
+    try:
+        runtime.run_forever(args.metrics_port, args.metrics_file)
+    finally:
+        if args.snapshot:
+            runtime.save_snapshot(args.snapshot)
+            print(f"Snapshot saved to {args.snapshot}")
+
+
+if __name__ == "__main__":
+    main()
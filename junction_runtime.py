@@ -0,0 +1,394 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from corridor import DEFAULT_CORRIDOR_SPEED_KMH, CorridorCoordinator
+from data_sources import ForecastingSource, GoogleMapsSource
+from intensity_tracker import IntensityTracker
+from junction_state import ApproachTable, JunctionState
+from maps_api import count_nearby_roads, determine_junction_intensities, name_roads
+from metrics import METRICS_FILE, METRICS_PORT, start_exporters
+from phase_timing import make_timing
+from resilience import FallbackPlans
+from signal_controller import JunctionController, Scheduler
+
+
+JUNCTION_PRESETS = {
+    "Narengi Tinali": (26.1786, 91.8293),
+    "Zoo Road Tinali": (26.1749, 91.7767),
+    "Jaynagar Chariali": (26.1223, 91.8061),
+    "Beltola Chariali": (26.1286, 91.8013),
+    "Mission Chariali(Tezpur)": (26.6608, 92.7755),
+    "Baihata Chariali": (26.3449, 91.7163),
+    "Ganesguri Chariali": (26.1498, 91.7852),
+    "Maligaon Chariali": (26.1592, 91.6961),
+    "Basistha Chariali": (26.1113, 91.7976),
+    "Thana Chariali(Dibrugarh)": (27.4810, 94.9076)
+}
+
+DEFAULT_RANGE_M = 50
+DEFAULT_LIFE_CYCLE_SECONDS = 120
+DEFAULT_MAX_SNAP_POINTS = 4
+SETUP_WORKERS = 4
+# Junctions whose discovery found no roads are retried this many times, backing off from the delay.
+DISCOVERY_RETRIES = 5
+DISCOVERY_RETRY_SECONDS = 60
+
+
+class JunctionConfig:
+    """
+    Settings for one junction, matching the fields of the Tk form.
+    Junctions that share a `corridor` name are coordinated into one green wave.
+    """
+
+    def __init__(self, box_id, latitude, longitude, range_m=DEFAULT_RANGE_M,
+                 life_cycle_seconds=DEFAULT_LIFE_CYCLE_SECONDS, max_snap_points=DEFAULT_MAX_SNAP_POINTS, name=None,
+                 corridor=None):
+        self.box_id = str(box_id)
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.range_m = float(range_m)
+        self.life_cycle_seconds = int(life_cycle_seconds)
+        self.max_snap_points = int(max_snap_points)
+        self.name = name or self.box_id
+        self.corridor = corridor
+
+    def as_dict(self):
+        return {"box_id": self.box_id, "latitude": self.latitude, "longitude": self.longitude,
+                "range_m": self.range_m, "life_cycle_seconds": self.life_cycle_seconds,
+                "max_snap_points": self.max_snap_points, "name": self.name, "corridor": self.corridor}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a config from a dict. A junction can name one of JUNCTION_PRESETS
+        under "preset" instead of giving its coordinates.
+        """
+        data = dict(data)
+        preset = data.pop("preset", None)
+        if preset is not None:
+            if preset not in JUNCTION_PRESETS:
+                raise ValueError(f"Unknown junction preset: {preset}")
+            data.setdefault("latitude", JUNCTION_PRESETS[preset][0])
+            data.setdefault("longitude", JUNCTION_PRESETS[preset][1])
+            data.setdefault("name", preset)
+        return cls(**data)
+
+
+def load_junction_configs(path):
+    """
+    Load junction configs from a JSON or YAML (.yaml/.yml, needs PyYAML) file
+    holding a list, or a dict with a "junctions" list.
+    """
+    with open(path) as file:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            data = yaml.safe_load(file)
+        else:
+            data = json.load(file)
+    if isinstance(data, dict):
+        data = data.get("junctions", [])
+    return [JunctionConfig.from_dict(entry) for entry in data]
+
+
+def _config_keys(configs):
+    return sorted(json.dumps(config.as_dict(), sort_keys=True) for config in configs)
+
+
+class Junction:
+    """
+    A configured junction: its rows in the runtime's ApproachTable, its controller and, when
+    planning on a forecast, the IntensityForecaster whose history is kept in snapshots.
+    """
+
+    __slots__ = ("config", "table", "index", "controller", "forecaster")
+
+    def __init__(self, config, table, index):
+        self.config = config
+        self.table = table
+        self.index = index
+        self.controller = None
+        self.forecaster = None
+
+    @property
+    def rows(self):
+        return self.table.rows(self.index)
+
+    @property
+    def coordinates(self):
+        """(latitude, longitude) of every approach, as a view into the table."""
+        return self.table.coordinates[self.rows]
+
+    @property
+    def road_names(self):
+        return self.table.names[self.rows].tolist()
+
+    @property
+    def snapped_points(self):
+        return self.table.snapped_points(self.index)
+
+
+class JunctionRuntime:
+    """
+    Runs the signal plans of many junctions in one process.
+    All junctions share one Scheduler and the process-wide Maps client, and their start
+    times are staggered so the intensity refreshes do not all hit the API at once.
+    `timing` is the PhaseTiming engine used by every controller. With `incremental_refresh`
+    each junction polls through an IntensityTracker, so stable approaches are polled less often.
+    `background_refresh` and `verbose` are passed on to every JunctionController.
+    Junctions configured with the same corridor get a CorridorCoordinator with a green wave
+    at `corridor_speed_kmh`. With `forecast` every controller plans on a ForecastingSource forecast
+    while the live polls run in the background, so a slow API never delays or invalidates a plan.
+    Approach state lives in one ApproachTable; call setup() or restore() once per runtime.
+    Every controller gets FallbackPlans, so it keeps running on its last good or time-of-day plan
+    while the API is failing. Junctions whose discovery finds no roads are retried in the background
+    up to `discovery_retries` times and join the runtime (uncoordinated) once they are found.
+    """
+
+    def __init__(self, api_key, scheduler=None, refresh_spread_seconds=None, setup_workers=SETUP_WORKERS,
+                 timing=None, incremental_refresh=True, background_refresh=True, verbose=True,
+                 corridor_speed_kmh=DEFAULT_CORRIDOR_SPEED_KMH, forecast=False,
+                 discovery_retries=DISCOVERY_RETRIES, discovery_retry_seconds=DISCOVERY_RETRY_SECONDS):
+        self.api_key = api_key
+        self.scheduler = scheduler or Scheduler()
+        self.timing = timing or make_timing()
+        self.incremental_refresh = incremental_refresh
+        self.background_refresh = background_refresh
+        self.verbose = verbose
+        self.refresh_spread_seconds = refresh_spread_seconds
+        self.setup_workers = setup_workers
+        self.corridor_speed_kmh = corridor_speed_kmh
+        self.forecast = forecast
+        self.discovery_retries = discovery_retries
+        self.discovery_retry_seconds = discovery_retry_seconds
+        # Converts scheduler time to local wall-clock time for the fallbacks' time-of-day profile.
+        self.fallback_utc_offset = time.time() - self.scheduler.now() + time.localtime().tm_gmtoff
+        self.junctions = []
+        self.corridors = []
+        self.table = None
+        self.observers = []
+        self.cycle_observers = []
+        self.junction_observers = []
+        # Counted from the setup thread, the discovery retry threads and the scheduler thread.
+        self.pending_discoveries = 0
+        self.discovery_lock = threading.Lock()
+        self.running = False
+
+    def _discover(self, config):
+        snapped_points, num_roads = count_nearby_roads(config.latitude, config.longitude, self.api_key,
+                                                       config.range_m, max_snap_points=config.max_snap_points)
+        if num_roads == 0:
+            print(f"No roads found near junction {config.box_id} ({config.name}), skipping it.")
+            return None
+        road_names = name_roads(snapped_points, self.api_key)
+        print(f"Junction {config.box_id} ({config.name}): found {num_roads} roads: {', '.join(road_names)}")
+        return config, snapped_points, road_names
+
+    def _initial_intensities(self, configs, snapped_point_lists):
+        """
+        First intensities of new junctions, fetched in shared batches. An approach that fails starts
+        at its junction's mean rather than at 0, which would give it the shortest green.
+        """
+        intensity_lists = determine_junction_intensities(snapped_point_lists,
+                                                         [(config.latitude, config.longitude) for config in configs],
+                                                         self.api_key,
+                                                         [[None] * len(points) for points in snapped_point_lists])
+        filled = []
+        for intensities in intensity_lists:
+            known = [intensity for intensity in intensities if intensity is not None]
+            neutral = round(sum(known) / len(known)) if known else 0
+            filled.append([neutral if intensity is None else intensity for intensity in intensities])
+        return filled
+
+    def setup(self, configs):
+        """Discover and name the roads of every junction, then fetch their first intensities in shared batches."""
+        with ThreadPoolExecutor(max_workers=self.setup_workers) as executor:
+            results = list(executor.map(self._discover, configs))
+        discovered = [result for result in results if result is not None]
+        for config, result in zip(configs, results):
+            if result is None and self.discovery_retries > 0:
+                self._schedule_discovery(config, 0)
+
+        snapped_point_lists = [snapped_points for _, snapped_points, _ in discovered]
+        initial_intensities = self._initial_intensities([config for config, _, _ in discovered], snapped_point_lists)
+        table = ApproachTable.from_junctions(snapped_point_lists, [road_names for _, _, road_names in discovered],
+                                             initial_intensities)
+        return self._build([config for config, _, _ in discovered], table)
+
+    def _schedule_discovery(self, config, attempt):
+        delay = self.discovery_retry_seconds * (2 ** attempt)
+        print(f"Retrying road discovery for junction {config.box_id} ({config.name}) in {delay:.0f} seconds.")
+        with self.discovery_lock:
+            self.pending_discoveries += 1
+        self.scheduler.call_later(delay, self._start_discovery_retry, config, attempt + 1)
+
+    def _start_discovery_retry(self, config, attempt):
+        # Discovery makes blocking API calls, so it runs off the scheduler thread.
+        threading.Thread(target=self._retry_discovery, args=(config, attempt), daemon=True).start()
+
+    def _retry_discovery(self, config, attempt):
+        try:
+            discovered = self._discover(config)
+            if discovered is not None:
+                _, snapped_points, road_names = discovered
+                intensities = self._initial_intensities([config], [snapped_points])[0]
+                self.scheduler.call_later(0, self._add_junction, config, snapped_points, road_names, intensities)
+                return
+        except Exception as e:
+            print(f"Error discovering the roads of junction {config.box_id}: {e}")
+        with self.discovery_lock:
+            self.pending_discoveries -= 1
+        if attempt < self.discovery_retries:
+            self._schedule_discovery(config, attempt)
+        else:
+            print(f"Giving up on junction {config.box_id} ({config.name}) after {attempt} discovery retries.")
+
+    def _add_junction(self, config, snapped_points, road_names, intensities):
+        """Add a junction discovered after setup() to the table and start it if the runtime is running."""
+        with self.discovery_lock:
+            self.pending_discoveries -= 1
+        index = self.table.append(snapped_points, road_names, intensities)
+        junction = self._make_junction(config, self.table, index)
+        self.junctions.append(junction)
+        for observer in self.junction_observers:
+            observer(junction)
+        if self.running:
+            junction.controller.start()
+
+    def restore(self, path, expected_configs=None):
+        """
+        Rebuild the junctions from a snapshot written by save_snapshot(), without any discovery or naming calls.
+        With `expected_configs` the snapshot is only restored if it holds exactly those junctions (in any order);
+        otherwise nothing is built and None is returned.
+        """
+        table, metadata, columns = ApproachTable.load(path)
+        configs = [JunctionConfig.from_dict(entry) for entry in metadata["junctions"]]
+        if expected_configs is not None and _config_keys(configs) != _config_keys(expected_configs):
+            print(f"Snapshot {path} does not match the junction config, setting the junctions up again.")
+            return None
+        print(f"Restored {len(configs)} junctions from {path}")
+        forecast_history = {name[len("forecast_"):]: values for name, values in columns.items()
+                            if name.startswith("forecast_")}
+        return self._build(configs, table, forecast_history or None)
+
+    def _make_junction(self, config, table, index, forecast_history=None):
+        junction = Junction(config, table, index)
+        state = JunctionState(table, index)
+        intensities = [round(intensity) for intensity in state.intensities.tolist()]
+        source = GoogleMapsSource(junction.coordinates, self.api_key, (config.latitude, config.longitude))
+        samples = None
+        if self.forecast:
+            source = ForecastingSource(source, len(intensities), clock=time.time,
+                                       horizon_seconds=config.life_cycle_seconds / 2,
+                                       asynchronous=self.background_refresh)
+            samples = source.take_samples
+            junction.forecaster = source.forecaster
+            if forecast_history is not None:
+                try:
+                    source.forecaster.load_history({name: values[junction.rows]
+                                                    for name, values in forecast_history.items()})
+                except (KeyError, ValueError) as e:
+                    print(f"Not restoring the forecast history of junction {config.box_id}: {e}")
+        tracker = IntensityTracker(None, state=state) if self.incremental_refresh else None
+        fallback = FallbackPlans(self.timing, config.life_cycle_seconds, intensities,
+                                 utc_offset=self.fallback_utc_offset)
+        junction.controller = JunctionController(config.box_id, junction.road_names, self.scheduler,
+                                                 source.fetch_intensities, config.life_cycle_seconds,
+                                                 timing=self.timing, tracker=tracker,
+                                                 background_refresh=self.background_refresh,
+                                                 verbose=self.verbose, fallback=fallback, state=state,
+                                                 samples=samples)
+        for observer in self.observers:
+            junction.controller.subscribe(observer)
+        for observer in self.cycle_observers:
+            junction.controller.subscribe_cycles(observer)
+        return junction
+
+    def _build(self, configs, table, forecast_history=None):
+        self.table = table
+        junctions = [self._make_junction(config, table, index, forecast_history)
+                     for index, config in enumerate(configs)]
+        self.junctions.extend(junctions)
+        for junction in junctions:
+            for observer in self.junction_observers:
+                observer(junction)
+
+        members = {}
+        for junction in junctions:
+            if junction.config.corridor is not None:
+                members.setdefault(junction.config.corridor, []).append(junction)
+        for name, corridor_junctions in members.items():
+            if len(corridor_junctions) > 1:
+                self.corridors.append(CorridorCoordinator(name, corridor_junctions, self.scheduler,
+                                                          self.corridor_speed_kmh, verbose=self.verbose))
+        return junctions
+
+    def save_snapshot(self, path):
+        """
+        Write the junction configs and approach state to `path` for a fast restart with restore(),
+        with the forecast history of every junction when planning on a forecast.
+        """
+        columns = {}
+        if self.junctions and all(junction.forecaster is not None for junction in self.junctions):
+            # Junctions are in table order, so the stacked histories line up with the table rows.
+            histories = [junction.forecaster.history() for junction in self.junctions]
+            columns = {f"forecast_{name}": np.concatenate([history[name] for history in histories])
+                       for name in histories[0]}
+        self.table.save(path, {"junctions": [junction.config.as_dict() for junction in self.junctions]}, columns)
+
+    def subscribe(self, observer):
+        """Register `observer(event)` on every junction controller, including junctions added later."""
+        self.observers.append(observer)
+        for junction in self.junctions:
+            junction.controller.subscribe(observer)
+
+    def subscribe_cycles(self, observer):
+        """Register `observer(event)` for the CycleEvent of every junction controller."""
+        self.cycle_observers.append(observer)
+        for junction in self.junctions:
+            junction.controller.subscribe_cycles(observer)
+
+    def subscribe_junctions(self, observer):
+        """Call `observer(junction)` for every junction, now and as junctions are added later."""
+        self.junction_observers.append(observer)
+        for junction in self.junctions:
+            observer(junction)
+
+    def start(self):
+        """Start every controller, spreading their cycles evenly over the refresh spread."""
+        self.running = True
+        if not self.junctions:
+            return
+        spread = self.refresh_spread_seconds
+        if spread is None:
+            spread = min(junction.config.life_cycle_seconds for junction in self.junctions)
+        step = spread / len(self.junctions)
+        for i, junction in enumerate(self.junctions):
+            junction.controller.start(delay=i * step)
+        for corridor in self.corridors:
+            corridor.start()
+
+    def run_forever(self, metrics_port=METRICS_PORT, metrics_file=METRICS_FILE):
+        """
+        Start the controllers and run the shared scheduler on this thread until interrupted.
+        Metrics are exported as configured by ITMS_METRICS_PORT and ITMS_METRICS_FILE by default.
+        """
+        start_exporters(metrics_port, metrics_file)
+        self.start()
+        try:
+            self.scheduler.run()
+        except KeyboardInterrupt:
+            print("Stopping junction runtime.")
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.running = False
+        for corridor in self.corridors:
+            corridor.stop()
+        for junction in self.junctions:
+            junction.controller.stop()
+        self.scheduler.stop()
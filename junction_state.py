@@ -0,0 +1,113 @@
+import json
+
+import numpy as np
+
+
+class ApproachTable:
+    """
+    Struct-of-arrays state for the approaches of many junctions.
+    Approach i of junction k is row starts[k] + i of every column: coordinates (float64, N x 2),
+    current and smoothed intensity and planned green time (float32), and placeId and name
+    (fixed-width strings). A process running thousands of approaches holds a handful of arrays
+    instead of a Roads API dict, a name list and intensity lists per junction, and the whole
+    table can be written to and restored from a snapshot without any API calls.
+    """
+
+    def __init__(self, starts, coordinates, place_ids, names, intensities=None, smoothed=None, greens=None):
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        count = len(self.coordinates)
+        self.place_ids = np.asarray(place_ids, dtype=str).reshape(count)
+        self.names = np.asarray(names, dtype=str).reshape(count)
+        self.intensities = np.zeros(count, np.float32) if intensities is None else np.asarray(intensities, np.float32)
+        self.smoothed = self.intensities.copy() if smoothed is None else np.asarray(smoothed, np.float32)
+        self.greens = np.zeros(count, np.float32) if greens is None else np.asarray(greens, np.float32)
+
+    @classmethod
+    def from_junctions(cls, snapped_point_lists, road_name_lists, intensity_lists=None):
+        """Build the table from per-junction snapped points, road names and (optionally) intensities."""
+        sizes = [len(points) for points in snapped_point_lists]
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1])) if sizes else []
+        points = [point for snapped_points in snapped_point_lists for point in snapped_points]
+        coordinates = [(point['location']['latitude'], point['location']['longitude']) for point in points]
+        place_ids = [point.get('placeId') or "" for point in points]
+        names = [name for road_names in road_name_lists for name in road_names]
+        intensities = None
+        if intensity_lists is not None:
+            intensities = [float(intensity or 0) for values in intensity_lists for intensity in values]
+        return cls(starts, coordinates, place_ids, names, intensities)
+
+    def append(self, snapped_points, road_names, intensities=None):
+        """Add the approaches of one more junction at the end of the table. Returns its position."""
+        added = ApproachTable.from_junctions([snapped_points], [road_names],
+                                             None if intensities is None else [intensities])
+        self.starts = np.append(self.starts, len(self.coordinates)).astype(np.int32)
+        for column in ("coordinates", "place_ids", "names", "intensities", "smoothed", "greens"):
+            setattr(self, column, np.concatenate((getattr(self, column), getattr(added, column))))
+        return len(self.starts) - 1
+
+    def __len__(self):
+        return len(self.starts)
+
+    def rows(self, junction):
+        """Slice of the rows that hold the approaches of `junction` (its position in the table)."""
+        start = int(self.starts[junction])
+        stop = int(self.starts[junction + 1]) if junction + 1 < len(self.starts) else len(self.coordinates)
+        return slice(start, stop)
+
+    def snapped_points(self, junction):
+        """The approaches of `junction` as Roads API style dicts, for code that still expects them."""
+        rows = self.rows(junction)
+        return [{'location': {'latitude': float(latitude), 'longitude': float(longitude)}, 'placeId': str(place_id)}
+                for (latitude, longitude), place_id in zip(self.coordinates[rows], self.place_ids[rows])]
+
+    def save(self, path, metadata=None, columns=None):
+        """
+        Write the table, plus any JSON-serializable `metadata` and extra `columns` (arrays with one row
+        per approach, by name), to an uncompressed .npz snapshot.
+        """
+        with open(path, "wb") as file:
+            np.savez(file, starts=self.starts, coordinates=self.coordinates, place_ids=self.place_ids,
+                     names=self.names, intensities=self.intensities, smoothed=self.smoothed, greens=self.greens,
+                     metadata=np.array(json.dumps(metadata)), **{f"column_{name}": values
+                                                                 for name, values in (columns or {}).items()})
+
+    @classmethod
+    def load(cls, path):
+        """Read a snapshot written by save(). Returns (table, metadata, columns)."""
+        with np.load(path, allow_pickle=False) as data:
+            table = cls(data["starts"], data["coordinates"], data["place_ids"], data["names"],
+                        data["intensities"], data["smoothed"], data["greens"])
+            metadata = json.loads(str(data["metadata"]))
+            columns = {name[len("column_"):]: data[name] for name in data.files if name.startswith("column_")}
+        return table, metadata, columns
+
+
+class JunctionState:
+    """
+    The rows of one junction in an ApproachTable, which its controller and tracker read and write in place.
+    Every column is sliced on access, so the state follows the table when append() reallocates it.
+    """
+
+    __slots__ = ("table", "junction")
+
+    def __init__(self, table, junction):
+        self.table = table
+        self.junction = junction
+
+    @classmethod
+    def standalone(cls, count):
+        """State for a junction with `count` approaches that is not part of a shared table."""
+        return cls(ApproachTable([0], np.zeros((count, 2)), [""] * count, [""] * count), 0)
+
+    @property
+    def intensities(self):
+        return self.table.intensities[self.table.rows(self.junction)]
+
+    @property
+    def smoothed(self):
+        return self.table.smoothed[self.table.rows(self.junction)]
+
+    @property
+    def greens(self):
+        return self.table.greens[self.table.rows(self.junction)]
@@ -0,0 +1,448 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import tracemalloc
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+import maps_client
+from corridor import METERS_PER_DEGREE
+from junction_runtime import JunctionConfig, JunctionRuntime
+from maps_client import MapsClient, set_client
+from metrics import DEGRADED_CYCLES
+from phase_timing import DEFAULT_TIMING, TIMING_ENGINES, make_timing
+from road_cache import RoadCache, set_cache
+from signal_controller import Scheduler, SimulationClock
+
+
+# The mock street grid is centred here (Guwahati), with a street every BLOCK_METERS each way.
+LOAD_TEST_ORIGIN = (26.1445, 91.7362)
+BLOCK_METERS = 200
+# nearestRoads only snaps points within this distance of a road.
+SNAP_DISTANCE_M = 50
+# Median latency (s) and log-normal sigma of every mock endpoint.
+MOCK_LATENCIES = {
+    "roads": (0.08, 0.5),
+    "distancematrix": (0.15, 0.6),
+    "geocode": (0.06, 0.5),
+    "places": (0.12, 0.5),
+}
+# Free-flow speed (m/s) of the mock Distance Matrix; traffic slows every origin by up to MAX_CONGESTION times.
+FREE_FLOW_SPEED_MPS = 8
+MAX_CONGESTION = 3
+# Every this many streets is unnamed, so naming falls back to the Places API.
+UNNAMED_STREET_EVERY = 7
+PERCENTILES = (50, 95, 99)
+
+
+class MockMapsServer:
+    """
+    Local HTTP stand-in for the Roads, Distance Matrix, Geocoding and Places endpoints.
+    The world is a grid of streets every `block_m` metres around `origin`: nearestRoads snaps each
+    point to the closest street (one placeId per block-long segment), so every intersection has
+    four approaches. Every response is delayed by a log-normal latency drawn from `latencies`
+    ({endpoint: (median_s, sigma)}), fails with HTTP 500 at `error_rate`, and each endpoint answers
+    as the real API does when over quota beyond `quota_qps` requests per second or `quota_requests`
+    requests in total. Distance Matrix free-flow durations follow the straight-line distance to the
+    destination, and durations in traffic add a fixed congestion factor per origin with `intensity_noise`
+    relative noise.
+    """
+
+    def __init__(self, origin=LOAD_TEST_ORIGIN, block_m=BLOCK_METERS, latencies=None, error_rate=0.0,
+                 quota_qps=None, quota_requests=None, intensity_noise=0.2, seed=0, host="127.0.0.1", port=0):
+        self.origin = origin
+        self.block_m = block_m
+        self.latencies = dict(MOCK_LATENCIES, **(latencies or {}))
+        self.error_rate = error_rate
+        self.quota_qps = quota_qps
+        self.quota_requests = quota_requests
+        self.intensity_noise = intensity_noise
+        self.rng = random.Random(seed)
+        self.paths = {urlsplit(url).path: endpoint for endpoint, url in maps_client.ENDPOINT_URLS.items()}
+        self.stats = {endpoint: {"requests": 0, "errors": 0, "over_quota": 0, "elements": 0}
+                      for endpoint in self.paths.values()}
+        self.windows = {endpoint: (0, 0) for endpoint in self.paths.values()}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), MockMapsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def endpoint_urls(self):
+        """ENDPOINT_URLS pointing at this server."""
+        return {endpoint: self.url + urlsplit(url).path for endpoint, url in maps_client.ENDPOINT_URLS.items()}
+
+    def get_stats(self):
+        with self.lock:
+            return {endpoint: dict(stats) for endpoint, stats in self.stats.items()}
+
+    def _over_quota(self, endpoint):
+        stats = self.stats[endpoint]
+        if self.quota_requests is not None and stats["requests"] > self.quota_requests:
+            return True
+        if self.quota_qps is None:
+            return False
+        second = int(time.monotonic())
+        window, count = self.windows[endpoint]
+        count = count + 1 if window == second else 1
+        self.windows[endpoint] = (second, count)
+        return count > self.quota_qps
+
+    def handle(self, path, params):
+        """Answer one request. Returns (status, body)."""
+        endpoint = self.paths.get(path)
+        if endpoint is None:
+            return 404, {"error": {"message": f"Unknown path {path}"}}
+        median, sigma = self.latencies[endpoint]
+        with self.lock:
+            latency = median * math.exp(sigma * self.rng.gauss(0, 1))
+            failed = self.rng.random() < self.error_rate
+            self.stats[endpoint]["requests"] += 1
+            over_quota = self._over_quota(endpoint)
+            if over_quota:
+                self.stats[endpoint]["over_quota"] += 1
+            elif failed:
+                self.stats[endpoint]["errors"] += 1
+        time.sleep(latency)
+        if over_quota:
+            if endpoint == "roads":
+                return 429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}
+            return 200, {"status": "OVER_QUERY_LIMIT", "error_message": "You have exceeded your quota."}
+        if failed:
+            return 500, {"error": {"code": 500, "status": "INTERNAL"}}
+        return 200, getattr(self, "_" + endpoint)(params)
+
+    def intersection_place_ids(self, latitude, longitude):
+        """placeIds of the four street segments that meet at the intersection closest to a point."""
+        north, east = self._to_meters(latitude, longitude)
+        row = round(north / self.block_m)
+        column = round(east / self.block_m)
+        return {f"mock-ew{row}-{column - 1}", f"mock-ew{row}-{column}",
+                f"mock-ns{column}-{row - 1}", f"mock-ns{column}-{row}"}
+
+    def _to_meters(self, latitude, longitude):
+        return ((latitude - self.origin[0]) * METERS_PER_DEGREE,
+                (longitude - self.origin[1]) * METERS_PER_DEGREE * math.cos(math.radians(self.origin[0])))
+
+    def _to_degrees(self, north_m, east_m):
+        return (self.origin[0] + north_m / METERS_PER_DEGREE,
+                self.origin[1] + east_m / (METERS_PER_DEGREE * math.cos(math.radians(self.origin[0]))))
+
+    def _snap(self, latitude, longitude):
+        """(north_m, east_m, distance_m, street, placeId) of the closest street to a point."""
+        north, east = self._to_meters(latitude, longitude)
+        row = round(north / self.block_m)
+        column = round(east / self.block_m)
+        if abs(north - row * self.block_m) <= abs(east - column * self.block_m):
+            segment = math.floor(east / self.block_m)
+            return row * self.block_m, east, abs(north - row * self.block_m), f"ew{row}", f"mock-ew{row}-{segment}"
+        segment = math.floor(north / self.block_m)
+        return (north, column * self.block_m, abs(east - column * self.block_m), f"ns{column}",
+                f"mock-ns{column}-{segment}")
+
+    @staticmethod
+    def _point(value):
+        latitude, longitude = value.split(",")
+        return float(latitude), float(longitude)
+
+    def _roads(self, params):
+        snapped = []
+        for i, point in enumerate(params.get("points", "").split("|")):
+            north, east, distance, _, place_id = self._snap(*self._point(point))
+            if distance > SNAP_DISTANCE_M:
+                continue
+            latitude, longitude = self._to_degrees(north, east)
+            snapped.append({"location": {"latitude": latitude, "longitude": longitude},
+                            "originalIndex": i, "placeId": place_id})
+        return {"snappedPoints": snapped}
+
+    def _distancematrix(self, params):
+        origins = params.get("origins", "").split("|")
+        destinations = params.get("destinations", "").split("|")
+        with self.lock:
+            self.stats["distancematrix"]["elements"] += len(origins) * len(destinations)
+            noise = [self.rng.uniform(-self.intensity_noise, self.intensity_noise) for _ in origins]
+        rows = []
+        for origin, relative_noise in zip(origins, noise):
+            congestion = 1 + (MAX_CONGESTION - 1) * (zlib.crc32(origin.encode()) % 1000) / 1000
+            elements = []
+            for destination in destinations:
+                north, east = self._to_meters(*self._point(origin))
+                destination_north, destination_east = self._to_meters(*self._point(destination))
+                free_flow = max(1, round(math.hypot(north - destination_north, east - destination_east)
+                                         / FREE_FLOW_SPEED_MPS))
+                value = max(1, round(free_flow * congestion * (1 + relative_noise)))
+                elements.append({"status": "OK", "duration": {"value": free_flow},
+                                 "duration_in_traffic": {"value": value}})
+            rows.append({"elements": elements})
+        return {"status": "OK", "rows": rows}
+
+    def _geocode(self, params):
+        _, _, _, street, _ = self._snap(*self._point(params.get("latlng", "0,0")))
+        named = zlib.crc32(street.encode()) % UNNAMED_STREET_EVERY
+        route = f"{street[:2].upper()} Street {street[2:]}" if named else "Unnamed Road"
+        return {"status": "OK", "results": [{"address_components": [
+            {"long_name": route, "types": ["route"]},
+            {"long_name": "Mock Town", "types": ["locality", "political"]},
+        ]}]}
+
+    def _places(self, params):
+        landmark = zlib.crc32(params.get("location", "").encode()) % 1000
+        return {"status": "OK", "results": [{"name": f"Landmark {landmark}", "types": ["school"]}]}
+
+
+class MockMapsHandler(BaseHTTPRequestHandler):
+    # Keep-alive, as the MapsClient connection pool expects.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        status, body = self.server.mock.handle(parts.path, dict(parse_qsl(parts.query)))
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LatencyRecorder:
+    """MapsClient recorder that keeps the latency of every final response, by endpoint."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, params, response, latency):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+
+    def reset(self):
+        with self.lock:
+            self.latencies = {}
+
+
+def percentiles(values):
+    """{50: p50, 95: p95, 99: p99} of `values`, in the same unit."""
+    if not len(values):
+        return {p: 0.0 for p in PERCENTILES}
+    return dict(zip(PERCENTILES, np.percentile(values, PERCENTILES).tolist()))
+
+
+def grid_junctions(count, origin=LOAD_TEST_ORIGIN, block_m=BLOCK_METERS, life_cycle_seconds=120):
+    """Configs for `count` junctions on every other intersection of the mock street grid."""
+    side = max(1, math.ceil(math.sqrt(count)))
+    north_scale = block_m / METERS_PER_DEGREE
+    east_scale = block_m / (METERS_PER_DEGREE * math.cos(math.radians(origin[0])))
+    return [JunctionConfig(f"J{i}", origin[0] + 2 * (i // side) * north_scale, origin[1] + 2 * (i % side) * east_scale,
+                           life_cycle_seconds=life_cycle_seconds, name=f"Mock junction {i}")
+            for i in range(count)]
+
+
+def check_discovery(runtime, server):
+    """Ids of the junctions whose discovered approaches are not the four streets of their intersection."""
+    return [junction.config.box_id for junction in runtime.junctions
+            if {point["placeId"] for point in junction.snapped_points}
+            != server.intersection_place_ids(junction.config.latitude, junction.config.longitude)]
+
+
+def _request_deltas(before, after):
+    return {endpoint: {name: after[endpoint][name] - before[endpoint][name] for name in after[endpoint]}
+            for endpoint in after}
+
+
+def run_load_test(junctions=100, hours=1.0, server_options=None, rate_limit=maps_client.DEFAULT_RATE_LIMIT,
+                  timing=None, incremental=True, trace_memory=False):
+    """
+    Set up `junctions` junctions against a MockMapsServer and run them for `hours` on a
+    SimulationClock. Refreshes run inline, so the clock only waits for the mock API; the
+    circuit breakers also run on the simulation clock.
+    Returns the setup and run metrics; the process-wide client and cache are restored afterwards.
+    """
+    server = MockMapsServer(**(server_options or {})).start()
+    original_urls = dict(maps_client.ENDPOINT_URLS)
+    maps_client.ENDPOINT_URLS.update(server.endpoint_urls())
+    recorder = LatencyRecorder()
+    clock = SimulationClock()
+    # Breakers time out on the simulation clock, or an open breaker would outlast the whole run.
+    set_client(MapsClient(rate_limit=rate_limit, burst=max(maps_client.DEFAULT_BURST, rate_limit // 5),
+                          recorder=recorder, breaker_options={"clock": clock}))
+    set_cache(RoadCache(":memory:"))
+    if trace_memory:
+        tracemalloc.start()
+    degraded_before = sum(DEGRADED_CYCLES.values.values())
+    try:
+        scheduler = Scheduler(clock=clock)
+        runtime = JunctionRuntime("load-test", scheduler=scheduler, timing=timing, incremental_refresh=incremental,
+                                  background_refresh=False, verbose=False, discovery_retries=0)
+        started = time.perf_counter()
+        runtime.setup(grid_junctions(junctions))
+        setup_seconds = time.perf_counter() - started
+        setup_requests = server.get_stats()
+        setup_latencies = {endpoint: percentiles(values) for endpoint, values in recorder.latencies.items()}
+        wrong_discoveries = check_discovery(runtime, server)
+        state_bytes = tracemalloc.get_traced_memory()[0] if trace_memory else None
+        recorder.reset()
+
+        refresh_seconds = []
+        refresh_cpu = [0.0]
+
+        def timed_fetch(fetch):
+            def fetch_intensities(*args):
+                started = time.perf_counter()
+                cpu_started = time.thread_time()
+                try:
+                    return fetch(*args)
+                finally:
+                    refresh_seconds.append(time.perf_counter() - started)
+                    refresh_cpu[0] += time.thread_time() - cpu_started
+            return fetch_intensities
+
+        for junction in runtime.junctions:
+            junction.controller.fetch_intensities = timed_fetch(junction.controller.fetch_intensities)
+
+        runtime.start()
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        scheduler.run_until(hours * 3600)
+        # Scheduler-thread CPU outside the refreshes is the controllers' own work.
+        controller_cpu = time.thread_time() - cpu_started - refresh_cpu[0]
+        run_seconds = time.perf_counter() - started
+        runtime.stop()
+        run_requests = _request_deltas(setup_requests, server.get_stats())
+        peak_bytes = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        server.stop()
+        maps_client.ENDPOINT_URLS.update(original_urls)
+        set_client(None)
+        set_cache(None)
+
+    cycles = sum(junction.controller.cycle_count for junction in runtime.junctions)
+    requests = sum(stats["requests"] for stats in run_requests.values())
+    return {
+        "junctions": len(runtime.junctions),
+        "approaches": len(runtime.table.coordinates),
+        "setup_seconds": setup_seconds,
+        "setup_requests": setup_requests,
+        "setup_latency": setup_latencies,
+        "wrong_discoveries": wrong_discoveries,
+        "cycles": cycles,
+        "run_seconds": run_seconds,
+        "cycles_per_second": cycles / run_seconds if run_seconds else 0.0,
+        "requests_per_second": requests / run_seconds if run_seconds else 0.0,
+        "run_requests": run_requests,
+        "api_calls_per_cycle": requests / cycles if cycles else 0.0,
+        "elements_per_cycle": run_requests["distancematrix"]["elements"] / cycles if cycles else 0.0,
+        "refresh_latency": percentiles(refresh_seconds),
+        "request_latency": {endpoint: percentiles(values) for endpoint, values in recorder.latencies.items()},
+        "degraded_cycles": sum(DEGRADED_CYCLES.values.values()) - degraded_before,
+        "controller_cpu_ms_per_cycle": controller_cpu * 1000 / cycles if cycles else 0.0,
+        "state_mb": state_bytes / 2 ** 20 if state_bytes is not None else None,
+        "peak_mb": peak_bytes / 2 ** 20 if peak_bytes is not None else None,
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+def max_rss_mb():
+    """Peak resident set size of the process, or None where the resource module is missing."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _format_percentiles(values, scale=1000):
+    return " / ".join(f"{values[p] * scale:.0f}" for p in PERCENTILES)
+
+
+def print_report(result):
+    print(f"\nSetup: {result['junctions']} junctions, {result['approaches']} approaches "
+          f"in {result['setup_seconds']:.2f} s ({result['junctions'] / result['setup_seconds']:.1f} junctions/s)")
+    print(f"{'Endpoint':<16}{'Requests':>10}{'Errors':>8}{'Quota':>7}   p50 / p95 / p99 (ms)")
+    for endpoint, stats in result["setup_requests"].items():
+        latency = result["setup_latency"].get(endpoint)
+        print(f"{endpoint:<16}{stats['requests']:>10}{stats['errors']:>8}{stats['over_quota']:>7}   "
+              f"{_format_percentiles(latency) if latency else '-'}")
+
+    wrong = result["wrong_discoveries"]
+    print(f"Discovery: {result['junctions'] - len(wrong)} of {result['junctions']} junctions found the four "
+          f"streets of their intersection" + (f" (wrong: {', '.join(wrong[:10])})" if wrong else ""))
+
+    print(f"\nRun: {result['cycles']} cycles in {result['run_seconds']:.2f} s "
+          f"({result['cycles_per_second']:.1f} cycles/s, {result['requests_per_second']:.1f} API requests/s)")
+    print(f"{'Endpoint':<16}{'Requests':>10}{'Errors':>8}{'Quota':>7}   p50 / p95 / p99 (ms)")
+    for endpoint, stats in result["run_requests"].items():
+        latency = result["request_latency"].get(endpoint)
+        print(f"{endpoint:<16}{stats['requests']:>10}{stats['errors']:>8}{stats['over_quota']:>7}   "
+              f"{_format_percentiles(latency) if latency else '-'}")
+    print(f"Refresh latency p50 / p95 / p99: {_format_percentiles(result['refresh_latency'])} ms")
+    print(f"API calls per cycle: {result['api_calls_per_cycle']:.2f} "
+          f"({result['elements_per_cycle']:.1f} Distance Matrix elements)")
+    print(f"Degraded cycles: {result['degraded_cycles']:.0f}")
+    print(f"Controller CPU: {result['controller_cpu_ms_per_cycle']:.3f} ms per cycle")
+    if result["state_mb"] is not None:
+        print(f"Memory: {result['state_mb']:.1f} MB after setup, {result['peak_mb']:.1f} MB peak (traced)")
+    if result["max_rss_mb"] is not None:
+        print(f"Max RSS: {result['max_rss_mb']:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test the junction runtime against a local mock of the Google Maps APIs.")
+    parser.add_argument("--junctions", type=int, default=100, help="junctions to set up")
+    parser.add_argument("--hours", type=float, default=1.0, help="simulated hours to run them for")
+    parser.add_argument("--timing", choices=list(TIMING_ENGINES), default=DEFAULT_TIMING, help="phase timing engine")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="refresh every approach each cycle instead of polling incrementally")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every mock median latency")
+    parser.add_argument("--latency-sigma", type=float, help="log-normal sigma of every mock latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock requests failing with 500")
+    parser.add_argument("--quota-qps", type=int, help="mock requests per second per endpoint before OVER_QUERY_LIMIT")
+    parser.add_argument("--quota-requests", type=int, help="mock requests per endpoint before OVER_QUERY_LIMIT")
+    parser.add_argument("--rate-limit", type=int, default=maps_client.DEFAULT_RATE_LIMIT,
+                        help="client-side requests per second")
+    parser.add_argument("--check-discovery", action="store_true",
+                        help="exit with status 1 if any junction did not discover its four streets")
+    parser.add_argument("--trace-memory", action="store_true", help="trace Python allocations (slows the run)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    latencies = {endpoint: (median * args.latency_scale, sigma if args.latency_sigma is None else args.latency_sigma)
+                 for endpoint, (median, sigma) in MOCK_LATENCIES.items()}
+    server_options = {"latencies": latencies, "error_rate": args.error_rate, "quota_qps": args.quota_qps,
+                      "quota_requests": args.quota_requests, "seed": args.seed}
+    result = run_load_test(args.junctions, args.hours, server_options, args.rate_limit, make_timing(args.timing),
+                           incremental=not args.full_refresh, trace_memory=args.trace_memory)
+    print_report(result)
+    if args.check_discovery and result["wrong_discoveries"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import json
+import os
+import string
+import threading
+
+
+MAP_FILE_NAME = "map_with_circle_and_traffic.html"
+# How often the page reloads its data script, and how often the overlay checks for changes.
+OVERLAY_REFRESH_SECONDS = 5
+
+# Compiled once. The page draws a circle per junction and a marker per approach, coloured by its
+# current phase and labelled with its intensity, from window.ITMS_OVERLAY. When $data_url is set,
+# the data script is reloaded every $refresh_ms so the page follows the junctions without a reload.
+MAP_TEMPLATE = string.Template("""
+    <html>
+    <head>
+      <title>$title</title>
+      <script src="https://maps.googleapis.com/maps/api/js?key=$api_key"></script>
+      <script>$inline_data</script>
+      <script>
+        var map, circles = {}, markers = {};
+        var dataUrl = $data_url, refreshMs = $refresh_ms;
+
+        function render(data) {
+          (data.junctions || []).forEach(function (junction) {
+            if (!circles[junction.id]) {
+              circles[junction.id] = new google.maps.Circle({
+                strokeColor: '#FF0000',
+                strokeOpacity: 0.8,
+                strokeWeight: 2,
+                fillColor: '#FF0000',
+                fillOpacity: 0.35,
+                map: map,
+                center: {lat: junction.lat, lng: junction.lng},
+                radius: junction.radius
+              });
+            }
+            (junction.approaches || []).forEach(function (approach, i) {
+              var key = junction.id + '/' + i;
+              if (!markers[key]) {
+                markers[key] = new google.maps.Marker({map: map, position: {lat: approach.lat, lng: approach.lng}});
+              }
+              markers[key].setIcon({path: google.maps.SymbolPath.CIRCLE, scale: 9, fillOpacity: 1,
+                                    fillColor: approach.color || 'gray', strokeWeight: 1});
+              markers[key].setLabel(approach.intensity == null ? null : String(approach.intensity));
+              markers[key].setTitle(junction.name + ': ' + approach.name + ' (' + (approach.color || '-') + ')');
+            });
+          });
+        }
+
+        function poll() {
+          var script = document.createElement('script');
+          script.src = dataUrl + '?t=' + Date.now();
+          script.onload = function () { render(window.ITMS_OVERLAY); script.remove(); };
+          script.onerror = function () { script.remove(); };
+          document.head.appendChild(script);
+        }
+
+        function initMap() {
+          map = new google.maps.Map(document.getElementById('map'), {
+            zoom: $zoom,
+            center: {lat: $center_lat, lng: $center_lng}
+          });
+
+          var trafficLayer = new google.maps.TrafficLayer();
+          trafficLayer.setMap(map); // Add traffic layer
+
+          if (window.ITMS_OVERLAY) render(window.ITMS_OVERLAY);
+          if (dataUrl) {
+            poll();
+            setInterval(poll, refreshMs);
+          }
+        }
+      </script>
+    </head>
+    <body onload="initMap()">
+      <div id="map" style="height: 100vh; width: 100%;"></div>
+    </body>
+    </html>
+    """)
+
+
+def _data_script(data):
+    return "window.ITMS_OVERLAY = " + json.dumps(data, separators=(',', ':')) + ";"
+
+
+def render_page(api_key, center, inline_data=None, data_url=None, zoom=15,
+                refresh_seconds=OVERLAY_REFRESH_SECONDS, title="Google Maps - Draw Circle with Traffic"):
+    return MAP_TEMPLATE.substitute(
+        title=title, api_key=api_key, zoom=zoom, center_lat=center[0], center_lng=center[1],
+        inline_data=_data_script(inline_data) if inline_data is not None else "",
+        data_url=json.dumps(data_url), refresh_ms=int(refresh_seconds * 1000),
+    )
+
+
+def _write_atomic(path, content):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        file.write(content)
+    os.replace(temp_path, path)
+
+
+def write_map(circles, api_key, file_name=MAP_FILE_NAME):
+    """
+    Write a static map with a red circle for every (latitude, longitude, radius_m) in `circles`,
+    centred on the first one, and return its absolute path.
+    """
+    data = {"junctions": [{"id": str(i), "name": "", "lat": latitude, "lng": longitude, "radius": radius}
+                          for i, (latitude, longitude, radius) in enumerate(circles)]}
+    _write_atomic(file_name, render_page(api_key, circles[0][:2], inline_data=data))
+    return os.path.abspath(file_name)
+
+
+class MapOverlay:
+    """
+    Live map of many junctions.
+    The page is rendered once; the junctions' circles, approach markers, phase colours and
+    intensities go to a small data script next to it (`<page>_data.js`) that the page reloads
+    every `refresh_seconds`. flush() only rewrites that script when the state has changed.
+    Subscribe the overlay to the controllers (it is a phase observer) and call start() with
+    their scheduler, or use attach() to do both for a JunctionRuntime.
+    """
+
+    def __init__(self, path, api_key, refresh_seconds=OVERLAY_REFRESH_SECONDS, zoom=13):
+        self.path = path
+        self.data_path = os.path.splitext(path)[0] + "_data.js"
+        self.api_key = api_key
+        self.refresh_seconds = refresh_seconds
+        self.zoom = zoom
+        self.junctions = []
+        self.controllers = {}
+        self.colors = {}
+        self.last_payload = None
+        self.writes = 0
+        self.running = False
+        self.scheduler = None
+        self.lock = threading.Lock()
+
+    def add_junction(self, junction_id, name, latitude, longitude, radius, approaches, controller=None):
+        """Add a junction; `approaches` is a list of (latitude, longitude, road_name)."""
+        self.junctions.append({
+            "id": str(junction_id), "name": name, "lat": latitude, "lng": longitude, "radius": radius,
+            "approaches": [{"lat": float(lat), "lng": float(lng), "name": road_name}
+                           for lat, lng, road_name in approaches],
+        })
+        if controller is not None:
+            self.controllers[str(junction_id)] = controller
+
+    def attach(self, runtime):
+        """
+        Add every junction of a JunctionRuntime, including junctions discovered later, subscribe to their
+        controllers and keep the data fresh. Returns the absolute path of the page.
+        """
+        runtime.subscribe_junctions(self.add_runtime_junction)
+        runtime.subscribe(self)
+        page_path = self.write_page()
+        self.flush()
+        self.start(runtime.scheduler)
+        return page_path
+
+    def add_runtime_junction(self, junction):
+        """Add the layout of one runtime Junction; the next flush puts it on the page."""
+        approaches = [(lat, lng, name) for (lat, lng), name in zip(junction.coordinates.tolist(),
+                                                                   junction.road_names)]
+        self.add_junction(junction.config.box_id, junction.config.name, junction.config.latitude,
+                          junction.config.longitude, junction.config.range_m, approaches, junction.controller)
+
+    def __call__(self, event):
+        """Phase observer: remember the approach's colour for the next flush."""
+        with self.lock:
+            self.colors[(str(event.junction_id), event.road_index)] = event.color
+
+    def snapshot(self):
+        """The current overlay data: the static junction layout plus colours and intensities."""
+        with self.lock:
+            colors = dict(self.colors)
+        junctions = []
+        for junction in self.junctions:
+            controller = self.controllers.get(junction["id"])
+            intensities = controller.intensities if controller is not None else []
+            approaches = []
+            for i, approach in enumerate(junction["approaches"]):
+                approaches.append(dict(approach, color=colors.get((junction["id"], i)),
+                                       intensity=intensities[i] if i < len(intensities) else None))
+            junctions.append(dict(junction, approaches=approaches))
+        return {"junctions": junctions}
+
+    def write_page(self):
+        if self.junctions:
+            center = (sum(j["lat"] for j in self.junctions) / len(self.junctions),
+                      sum(j["lng"] for j in self.junctions) / len(self.junctions))
+        else:
+            center = (0.0, 0.0)
+        page = render_page(self.api_key, center, data_url=os.path.basename(self.data_path), zoom=self.zoom,
+                           refresh_seconds=self.refresh_seconds, title="Junction Overlay")
+        _write_atomic(self.path, page)
+        return os.path.abspath(self.path)
+
+    def flush(self):
+        """Rewrite the data script if the overlay has changed since the last write. Returns True if written."""
+        payload = _data_script(self.snapshot())
+        if payload == self.last_payload:
+            return False
+        _write_atomic(self.data_path, payload)
+        self.last_payload = payload
+        self.writes += 1
+        return True
+
+    def start(self, scheduler):
+        """Flush every `refresh_seconds` on `scheduler`."""
+        self.running = True
+        self.scheduler = scheduler
+        scheduler.call_later(self.refresh_seconds, self._tick)
+
+    def _tick(self):
+        if not self.running:
+            return
+        try:
+            self.flush()
+        except OSError as e:
+            print(f"Error writing map overlay {self.data_path}: {e}")
+        self.scheduler.call_later(self.refresh_seconds, self._tick)
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,558 @@
+import math
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+from maps_client import get_client
+from metrics import timed
+from road_cache import get_cache
+
+
+# Concurrency limit and batch deadline (seconds) for refreshing traffic intensities.
+# The deadline keeps a refresh inside the 5 second yellow phase it runs in.
+INTENSITY_FETCH_WORKERS = 8
+INTENSITY_FETCH_DEADLINE = 4.5
+
+# Distance Matrix limits: at most 25 origins or destinations and 100 elements per request.
+# Each batch sends N origins to one shared destination, so it is billed N elements, all of them used.
+DISTANCE_MATRIX_MAX_LOCATIONS = 25
+DISTANCE_MATRIX_MAX_ELEMENTS = 100
+DISTANCE_MATRIX_BATCH_SIZE = 25
+# Intensities are the duration in traffic over the free-flow duration, times this: 100 is free flow.
+CONGESTION_SCALE = 100
+
+# nearestRoads accepts up to 100 points per request.
+NEAREST_ROADS_MAX_POINTS = 100
+# Road discovery samples a grid with this many steps each side of the junction (a 9 x 9 grid
+# clipped to a circle fits in one nearestRoads request), doubling the radius up to
+# DISCOVERY_MAX_EXPANSIONS times. Roads whose representative points (out along the arm) are within
+# DISCOVERY_CLUSTER_DISTANCE_M (and half the sample spacing) are treated as the same road.
+DISCOVERY_GRID_DIVISIONS = 4
+DISCOVERY_MAX_EXPANSIONS = 6
+DISCOVERY_CLUSTER_DISTANCE_M = 5
+
+# Approaches of a junction are named concurrently by up to this many threads.
+NAMING_WORKERS = 8
+# Statuses of a successful Geocoding or Places response; quota and other errors also come back as HTTP 200.
+SUCCESS_STATUSES = {"OK", "ZERO_RESULTS"}
+# Placeholder names that must not be memoized as a road's name.
+UNRESOLVED_ROAD_NAMES = {"Error retrieving road name", "No identifiable name available"}
+
+
+def meters_to_degrees_latitude(meters):
+    return meters / 111320
+
+
+def meters_to_degrees_longitude(meters, latitude):
+    return meters / (111320 * math.cos(math.radians(latitude)))
+
+
+def snapped_coordinates(snapped_points):
+    """(latitude, longitude) of every Roads API snapped point."""
+    return [(point['location']['latitude'], point['location']['longitude']) for point in snapped_points]
+
+
+def get_nearest_road(latitude, longitude, api_key):
+    cache = get_cache()
+    cache_key = cache.make_key(latitude, longitude)
+    cached_points = cache.get("roads", cache_key)
+    if cached_points is not None:
+        return cached_points
+
+    response = get_client().get("roads", params={'points': f'{latitude},{longitude}', 'key': api_key})
+    if response is not None and response.status_code == 200:
+        data = response.json()
+        snapped_points = data.get('snappedPoints', [])
+        cache.put("roads", cache_key, snapped_points)
+        return snapped_points
+    else:
+        print("Error fetching data from Roads API")
+        return []
+
+
+def get_nearest_roads_batch(coordinates, api_key):
+    """
+    Snap up to NEAREST_ROADS_MAX_POINTS points per nearestRoads request.
+    Returns one list of snapped points per input coordinate, or None for points whose request
+    failed. Points already in the cache are not requested again.
+    """
+    cache = get_cache()
+    cache_keys = [cache.make_key(lat, lon) for lat, lon in coordinates]
+    results = [cache.get("roads", cache_key) for cache_key in cache_keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    for start in range(0, len(pending), NEAREST_ROADS_MAX_POINTS):
+        batch = pending[start:start + NEAREST_ROADS_MAX_POINTS]
+        points_param = '|'.join(f'{coordinates[i][0]},{coordinates[i][1]}' for i in batch)
+        response = get_client().get("roads", params={'points': points_param, 'key': api_key})
+        if response is None or response.status_code != 200:
+            print("Error fetching data from Roads API")
+            continue
+
+        snapped_by_index = {i: [] for i in batch}
+        for point in response.json().get('snappedPoints', []):
+            original = batch[point.get('originalIndex', 0)]
+            snapped_by_index[original].append(point)
+        for i, snapped_points in snapped_by_index.items():
+            results[i] = snapped_points
+            cache.put("roads", cache_keys[i], snapped_points)
+
+    return results
+
+
+def build_sample_grid(latitude, longitude, radius_m, divisions=DISCOVERY_GRID_DIVISIONS):
+    """
+    Build a square grid of sample points with `divisions` steps on each side of the centre,
+    keeping only the points inside the circle of `radius_m`. Returns (latitudes, longitudes) arrays.
+    """
+    offsets = np.linspace(-radius_m, radius_m, 2 * divisions + 1)
+    north_m, east_m = np.meshgrid(offsets, offsets, indexing='ij')
+    inside = north_m ** 2 + east_m ** 2 <= radius_m ** 2
+    latitudes = latitude + meters_to_degrees_latitude(north_m[inside])
+    longitudes = longitude + meters_to_degrees_longitude(east_m[inside], latitude)
+    return latitudes, longitudes
+
+
+def cluster_snapped_points(snapped_points, latitude, longitude, cluster_distance_m=DISCOVERY_CLUSTER_DISTANCE_M,
+                           range_m=None):
+    """
+    Group snapped points into roads. Points that share a placeId are one road, represented by its
+    farthest point within `range_m` of the centre (its closest point if none is): the samples near
+    the centre all snap onto the junction node, where the bearing of an arm is meaningless. A road
+    whose representative lies within `cluster_distance_m` of an earlier road's representative is
+    merged into it; only representatives are compared, never point to point, so roads that meet at
+    the junction do not chain into one cluster. Uses a hash grid with cells of `cluster_distance_m`.
+    Returns one (representative, distance, bearing) per cluster: the distance (m) of the road's
+    closest point to the centre and the bearing (degrees from north) of its representative.
+    """
+    if not snapped_points:
+        return []
+
+    coords = np.array(snapped_coordinates(snapped_points))
+    north_m = (coords[:, 0] - latitude) * 111320
+    east_m = (coords[:, 1] - longitude) * 111320 * math.cos(math.radians(latitude))
+    distances = np.hypot(north_m, east_m)
+    bearings = np.degrees(np.arctan2(east_m, north_m)) % 360
+    cells = np.floor(np.column_stack((north_m, east_m)) / cluster_distance_m).astype(int)
+
+    roads = {}
+    for i, point in enumerate(snapped_points):
+        place_id = point.get('placeId')
+        roads.setdefault(('place', place_id) if place_id is not None else ('point', i), []).append(i)
+
+    representatives = {}
+    clusters = []
+    # Visit roads from the centre outwards, so a merged road keeps the representative of the closest one.
+    for points in sorted(roads.values(), key=lambda points: float(distances[points].min())):
+        within = [i for i in points if range_m is None or distances[i] <= range_m]
+        i = max(within, key=lambda i: distances[i]) if within else min(points, key=lambda i: distances[i])
+        cell_n, cell_e = cells[i]
+        merged = any(math.hypot(north_m[i] - north_m[j], east_m[i] - east_m[j]) <= cluster_distance_m
+                     for dn in (-1, 0, 1) for de in (-1, 0, 1)
+                     for j in representatives.get((cell_n + dn, cell_e + de), ()))
+        if not merged:
+            clusters.append((snapped_points[i], float(distances[points].min()), float(bearings[i])))
+            representatives.setdefault((cell_n, cell_e), []).append(i)
+
+    return clusters
+
+
+@timed("discovery")
+def count_nearby_roads(latitude, longitude, api_key, range_m, max_snap_points=4):
+    """
+    Discover the approaches of a junction.
+    Samples a grid around the junction with batched nearestRoads requests, doubling the search
+    radius until `max_snap_points` distinct roads are found, then returns the closest ones
+    ordered clockwise from north. Results from a search with failed requests are not cached.
+    """
+    cache = get_cache()
+    cache_key = cache.make_key(latitude, longitude, range_m, max_snap_points, "grid")
+    cached_points = cache.get("discovery", cache_key)
+    if cached_points is not None:
+        return cached_points, len(cached_points)
+
+    candidates = []
+    clusters = []
+    complete = True
+    # Merge well inside the spacing of the densest (first) sample grid, or neighbouring samples on
+    # different roads would be merged.
+    cluster_distance_m = min(DISCOVERY_CLUSTER_DISTANCE_M, range_m / DISCOVERY_GRID_DIVISIONS / 2)
+    for expansion in range(DISCOVERY_MAX_EXPANSIONS + 1):
+        latitudes, longitudes = build_sample_grid(latitude, longitude, range_m * (2 ** expansion))
+        for points in get_nearest_roads_batch(list(zip(latitudes.tolist(), longitudes.tolist())), api_key):
+            if points is None:
+                complete = False
+                continue
+            candidates.extend(points)
+        clusters = cluster_snapped_points(candidates, latitude, longitude, cluster_distance_m, range_m)
+        if len(clusters) >= max_snap_points or not complete:
+            # Stop expanding on failures: a wider ring could replace an approach we merely failed to snap.
+            break
+
+    nearest = sorted(clusters, key=lambda cluster: cluster[1])[:max_snap_points]
+    snapped_points = [point for point, _, _ in sorted(nearest, key=lambda cluster: cluster[2])]
+
+    num_roads = len(snapped_points)
+    if num_roads > 0 and complete:
+        cache.put("discovery", cache_key, snapped_points)
+    return snapped_points, num_roads
+
+
+def get_traffic_data(latitude, longitude, api_key, retries=3):
+    for _ in range(retries):
+        params = {
+            'origins': f'{latitude},{longitude}',
+            'destinations': f'{latitude + 0.001},{longitude + 0.001}',
+            'departure_time': 'now',
+            'traffic_model': 'best_guess',
+            'key': api_key,
+        }
+        response = get_client().get("distancematrix", params=params)
+        if response is not None and response.status_code == 200:
+            data = response.json()
+            if 'rows' in data and 'elements' in data['rows'][0] and 'duration_in_traffic' in \
+                    data['rows'][0]['elements'][0]:
+                traffic_intensity = data['rows'][0]['elements'][0]['duration_in_traffic']['value']
+                if traffic_intensity > 0:
+                    return traffic_intensity
+            else:
+                print("No traffic data available for the specified location")
+
+    print("Error fetching data from Traffic API or all attempts returned 0 traffic intensity")
+    return None
+
+
+def get_traffic_data_batch(coordinates, destination, api_key, retries=3):
+    """
+    Fetch traffic intensities for several points with a single Distance Matrix request.
+    Every point is an origin, out along its arm, and they share one `destination`, the configured
+    junction centre, so a batch of N points costs N elements. The intensity of a point is its
+    congestion index: its duration in traffic to the junction as a percentage of the free-flow
+    duration, so the length of the arm cancels out. Returns one intensity (or None) per point.
+    """
+    intensities = [None] * len(coordinates)
+    pending = list(range(len(coordinates)))
+
+    for _ in range(retries):
+        params = {
+            'origins': '|'.join(f'{coordinates[i][0]},{coordinates[i][1]}' for i in pending),
+            'destinations': f'{destination[0]},{destination[1]}',
+            'departure_time': 'now',
+            'traffic_model': 'best_guess',
+            'key': api_key,
+        }
+        response = get_client().get("distancematrix", params=params)
+        if response is not None and response.status_code == 200:
+            rows = response.json().get('rows', [])
+            for row, i in enumerate(pending):
+                try:
+                    element = rows[row]['elements'][0]
+                    free_flow = element['duration']['value']
+                    in_traffic = element['duration_in_traffic']['value']
+                except (IndexError, KeyError):
+                    continue
+                if free_flow > 0 and in_traffic > 0:
+                    intensities[i] = round(CONGESTION_SCALE * in_traffic / free_flow)
+
+        pending = [i for i in pending if intensities[i] is None]
+        if not pending:
+            return intensities
+
+    print(f"No traffic data for {len(pending)} of {len(coordinates)} points in Distance Matrix batch")
+    return intensities
+
+
+def chunk_for_distance_matrix(count, batch_size=DISTANCE_MATRIX_BATCH_SIZE):
+    """Split `count` points that share a destination into index ranges within the Distance Matrix limits."""
+    batch_size = max(1, min(batch_size, DISTANCE_MATRIX_MAX_LOCATIONS, DISTANCE_MATRIX_MAX_ELEMENTS))
+    return [range(start, min(start + batch_size, count)) for start in range(0, count, batch_size)]
+
+
+@timed("intensity_fetch")
+def fetch_traffic_intensities(coordinates, destinations, api_key, previous_intensities=None,
+                              max_workers=INTENSITY_FETCH_WORKERS, deadline=None,
+                              batch_size=DISTANCE_MATRIX_BATCH_SIZE):
+    """
+    Fetch the traffic intensity of every (latitude, longitude) pair.
+    `destinations` gives the destination of every point, its junction's configured centre.
+    Points with the same destination are packed into batched Distance Matrix requests which
+    run concurrently.
+    Points that fail, or whose batch does not answer before the deadline, keep their
+    previous value (0 if there is none).
+    """
+    if previous_intensities is None:
+        previous_intensities = [0] * len(coordinates)
+    intensities = list(previous_intensities)
+    if len(coordinates) == 0:
+        return intensities
+
+    groups = {}
+    for i, destination in enumerate(destinations):
+        groups.setdefault(tuple(destination), []).append(i)
+    chunks = [(destination, [indices[i] for i in chunk])
+              for destination, indices in groups.items()
+              for chunk in chunk_for_distance_matrix(len(indices), batch_size)]
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks))))
+    futures = {
+        executor.submit(get_traffic_data_batch, [coordinates[i] for i in chunk], destination, api_key): chunk
+        for destination, chunk in chunks
+    }
+    done, not_done = wait(futures, timeout=deadline)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for future in done:
+        try:
+            batch_intensities = future.result()
+        except Exception as e:
+            print(f"Error fetching traffic intensities: {e}")
+            continue
+        for i, intensity in zip(futures[future], batch_intensities):
+            if intensity is not None:
+                intensities[i] = intensity
+
+    if not_done:
+        missed = sum(len(futures[future]) for future in not_done)
+        print(f"{missed} of {len(coordinates)} approaches missed the refresh deadline, keeping previous values.")
+    return intensities
+
+
+def determine_traffic_intensities(snapped_points, centre, api_key, previous_intensities=None,
+                                  max_workers=INTENSITY_FETCH_WORKERS, deadline=None,
+                                  batch_size=DISTANCE_MATRIX_BATCH_SIZE):
+    """Fetch the traffic intensity of every snapped point of the junction at `centre` (latitude, longitude)."""
+    coordinates = snapped_coordinates(snapped_points)
+    return fetch_traffic_intensities(coordinates, [centre] * len(coordinates), api_key, previous_intensities,
+                                     max_workers, deadline, batch_size)
+
+
+def determine_junction_intensities(junction_points, centres, api_key, previous_intensities=None,
+                                   max_workers=INTENSITY_FETCH_WORKERS, deadline=None,
+                                   batch_size=DISTANCE_MATRIX_BATCH_SIZE):
+    """
+    Fetch traffic intensities for many junctions at once.
+    `junction_points` is a list of snapped point lists and `centres` the configured (latitude, longitude)
+    of every junction; the approaches of every junction are timed to its centre, the requests run
+    concurrently, and the result is split back into one intensity list per junction.
+    """
+    coordinates = []
+    destinations = []
+    previous = []
+    for j, (snapped_points, centre) in enumerate(zip(junction_points, centres)):
+        coordinates.extend(snapped_coordinates(snapped_points))
+        destinations.extend([tuple(centre)] * len(snapped_points))
+        if previous_intensities is not None:
+            previous.extend(previous_intensities[j])
+        else:
+            previous.extend([0] * len(snapped_points))
+
+    flat = fetch_traffic_intensities(coordinates, destinations, api_key, previous, max_workers, deadline, batch_size)
+
+    results = []
+    offset = 0
+    for snapped_points in junction_points:
+        results.append(flat[offset:offset + len(snapped_points)])
+        offset += len(snapped_points)
+    return results
+
+
+def reverse_geocode(latitude, longitude, api_key):
+    """
+    Reverse geocode a point with a single Geocoding API call.
+    Returns the decoded response, or None if the request failed.
+    """
+    response = get_client().get("geocode", params={'latlng': f'{latitude},{longitude}', 'key': api_key})
+    if response is not None and response.status_code == 200:
+        data = response.json()
+        if data.get('status') in SUCCESS_STATUSES:
+            return data
+        status = data.get('status')
+    else:
+        status = response.status_code if response is not None else "no response"
+    print(f"Error fetching road name from Geocoding API: {status}")
+    return None
+
+
+def route_name_from_geocode(data):
+    """Return the named route of the best geocoding result, or None if it is missing or unnamed."""
+    if 'results' in data and data['results']:
+        for component in data['results'][0]['address_components']:
+            if "route" in component['types']:  # "route" indicates a road/street name
+                road_name = component['long_name']
+                if road_name != "Unnamed Road":
+                    return road_name
+    return None
+
+
+def nearest_major_road_from_geocode(data):
+    """Look through every geocoding result for a named road, or a sublocality/locality to be near."""
+    for result in data.get('results', []):
+        # Try to find a more detailed road name by checking address components
+        for component in result['address_components']:
+            if "route" in component['types'] and component['long_name'] != "Unnamed Road":
+                return component['long_name']
+            # Look for sublocality, locality, etc. for hints if no road is found
+            elif "sublocality" in component['types']:
+                return f"Near {component['long_name']}"
+            elif "locality" in component['types']:
+                return f"Near {component['long_name']}"
+    return None
+
+
+def get_nearest_major_road(latitude, longitude, api_key):
+    """
+    Attempt to find a nearby major road when the road is unnamed.
+    """
+    data = reverse_geocode(latitude, longitude, api_key)
+    if data is None:
+        return "Error retrieving road name"
+    return nearest_major_road_from_geocode(data) or "Unnamed Road (No nearby major road found)"
+
+
+def get_road_name_from_coordinates(latitude, longitude, api_key):
+    """
+    Retrieves the road name from coordinates using Reverse Geocoding API.
+    If the road is unnamed, find the nearest major road in the same response.
+    """
+    data = reverse_geocode(latitude, longitude, api_key)
+    if data is None:
+        return "Error retrieving road name"
+    return (route_name_from_geocode(data) or nearest_major_road_from_geocode(data)
+            or "Unnamed Road (No nearby major road found)")
+
+
+def get_road_name_or_landmark(lat, lon, api_key):
+    """
+    Use Google's Geocoding API to get the nearest road name.
+    If the road is unnamed, find nearby landmarks or businesses, then fall back to a nearby
+    major road or locality from the same geocoding response.
+    """
+    cache = get_cache()
+    cache_key = cache.make_key(lat, lon)
+    cached_name = cache.get("road_name", cache_key)
+    if cached_name is not None:
+        return cached_name
+
+    data = reverse_geocode(lat, lon, api_key)
+    if data is None:
+        return "Error retrieving road name"
+
+    road_name = route_name_from_geocode(data)
+    if road_name is None:
+        # If no road name, search for nearby landmarks or businesses
+        business_names = find_nearby_businesses(lat, lon, api_key)
+        if business_names:
+            road_name = business_names[0]  # Use the first unique business name found
+        else:
+            road_name = nearest_major_road_from_geocode(data)
+    if road_name is None:
+        return "No identifiable name available"
+
+    cache.put("road_name", cache_key, road_name)
+    return road_name
+
+
+def find_nearby_businesses(lat, lon, api_key, radius=500):
+    """
+    Use Google Places API to find nearby businesses or landmarks such as schools, colleges, hotels, restaurants, gyms, car showrooms, highways, overbridges, universities, and other relevant places.
+    Returns a list of business names to ensure unique road naming.
+    """
+    types = [
+        'school', 'university', 'car_dealer', 'restaurant',
+        'shopping_mall', 'hospital', 'building', 'apartment', 'bridge'
+    ]
+    type_str = '|'.join(types)
+
+    cache = get_cache()
+    cache_key = cache.make_key(lat, lon, radius)
+    cached_names = cache.get("places", cache_key)
+    if cached_names is not None:
+        return cached_names
+
+    params = {'location': f'{lat},{lon}', 'radius': radius, 'keyword': type_str, 'key': api_key}
+    response = get_client().get("places", params=params)
+
+    data = response.json() if response is not None and response.status_code == 200 else None
+    if data is not None and data.get('status') in SUCCESS_STATUSES:
+        if 'results' in data and len(data['results']) > 0:
+            unique_businesses = set()
+            for place in data['results']:
+                place_types = place['types']
+                if any(p_type in place_types for p_type in types):
+                    unique_businesses.add(place['name'])  # Add unique names to the set
+            business_names = sorted(unique_businesses)  # Convert the set to a list for returning
+            cache.put("places", cache_key, business_names)
+            return business_names
+        cache.put("places", cache_key, [])
+        return []
+    elif data is not None:
+        status = data.get('status')
+    else:
+        status = response.status_code if response is not None else "no response"
+    print(f"Error fetching nearby places from Places API: {status}")
+    return []
+
+
+def ensure_unique_road_name(road_name, used_names):
+    """Ensure the road name is unique."""
+    base_name = road_name
+    counter = 1
+    while road_name in used_names:
+        road_name = f"{base_name} {counter}"
+        counter += 1
+    return road_name
+
+
+def name_for_snapped_point(point, api_key):
+    """
+    Name one snapped point. Names are memoized by placeId in the road cache,
+    so points on the same road segment, in any junction, share one lookup.
+    """
+    place_id = point.get('placeId')
+    cache = get_cache()
+    if place_id:
+        cached_name = cache.get("place_name", place_id)
+        if cached_name is not None:
+            return cached_name
+
+    road_name = get_road_name_or_landmark(point['location']['latitude'], point['location']['longitude'], api_key)
+    if place_id and road_name not in UNRESOLVED_ROAD_NAMES:
+        cache.put("place_name", place_id, road_name)
+    return road_name
+
+
+@timed("naming")
+def name_roads(snapped_points, api_key, max_workers=NAMING_WORKERS):
+    """
+    Name every snapped point of a junction, making sure no two roads share a name.
+    Points sharing a placeId (or quantized coordinates) are resolved once, and the
+    distinct points are named concurrently.
+    """
+    cache = get_cache()
+    keys = [point.get('placeId') or cache.make_key(point['location']['latitude'], point['location']['longitude'])
+            for point in snapped_points]
+    distinct = {}
+    for key, point in zip(keys, snapped_points):
+        distinct.setdefault(key, point)
+
+    names_by_key = {}
+    if distinct:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(distinct)))) as executor:
+            futures = {key: executor.submit(name_for_snapped_point, point, api_key)
+                       for key, point in distinct.items()}
+            for key, future in futures.items():
+                try:
+                    names_by_key[key] = future.result()
+                except Exception as e:
+                    print(f"Error naming road: {e}")
+                    names_by_key[key] = "Error retrieving road name"
+
+    road_names = []
+    used_names = set()  # To keep track of used names
+
+    for key in keys:
+        # Ensure uniqueness
+        road_name = ensure_unique_road_name(names_by_key[key], used_names)
+
+        used_names.add(road_name)
+        road_names.append(road_name)
+    return road_names
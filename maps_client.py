@@ -0,0 +1,216 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import record_api_call, record_short_circuit
+from resilience import CircuitBreaker
+
+
+# Base URLs for every Google Maps endpoint the controller talks to.
+ENDPOINT_URLS = {
+    "roads": "https://roads.googleapis.com/v1/nearestRoads",
+    "distancematrix": "https://maps.googleapis.com/maps/api/distancematrix/json",
+    "geocode": "https://maps.googleapis.com/maps/api/geocode/json",
+    "places": "https://maps.googleapis.com/maps/api/place/nearbysearch/json",
+}
+
+# (connect, read) timeouts in seconds for each endpoint.
+ENDPOINT_TIMEOUTS = {
+    "roads": (3.05, 5),
+    "distancematrix": (3.05, 4),
+    "geocode": (3.05, 5),
+    "places": (3.05, 8),
+}
+DEFAULT_TIMEOUT = (3.05, 10)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Quota exhaustion is reported with HTTP 200 by the Distance Matrix, Geocoding and Places APIs.
+QUOTA_ERROR_MARKER = b'"OVER_QUERY_LIMIT"'
+
+# Requests per second allowed across all endpoints, and the burst size.
+DEFAULT_RATE_LIMIT = 50
+DEFAULT_BURST = 10
+# Size the process-wide client to the project's actual quota.
+RATE_LIMIT = float(os.getenv("ITMS_RATE_LIMIT") or DEFAULT_RATE_LIMIT)
+BURST = float(os.getenv("ITMS_RATE_BURST") or DEFAULT_BURST)
+
+# When set, every API response is appended to this capture log (see api_capture.py).
+CAPTURE_PATH = os.getenv("ITMS_CAPTURE_PATH")
+
+
+class TokenBucket:
+    """Thread-safe token bucket used to stay under the API quota."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available and take them."""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class EndpointStats:
+    """Latency, retry and error counters for a single endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency, ok):
+        self.requests += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if not ok:
+            self.errors += 1
+
+    @property
+    def average_latency(self):
+        return self.total_latency / self.requests if self.requests else 0.0
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+            "average_latency": self.average_latency,
+            "max_latency": self.max_latency,
+        }
+
+
+class MapsClient:
+    """
+    Shared HTTP client for the Google Maps APIs.
+    Keeps connections alive in a pool, applies per-endpoint timeouts, retries 429/5xx responses
+    with bounded exponential backoff and throttles all calls through one token bucket.
+    The process-wide client's bucket is sized by ITMS_RATE_LIMIT and ITMS_RATE_BURST.
+    If a `recorder` is given, every final response is passed to `recorder.record(...)`.
+    Every endpoint has a CircuitBreaker: once it opens after repeated failures (network errors,
+    non-2xx replies or OVER_QUERY_LIMIT), get() returns None at once until a trial request succeeds.
+    """
+
+    def __init__(self, rate_limit=DEFAULT_RATE_LIMIT, burst=DEFAULT_BURST, max_retries=3,
+                 backoff_base=0.2, backoff_max=4.0, pool_size=16, recorder=None, breaker_options=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(ENDPOINT_URLS), pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.rate_limiter = TokenBucket(rate_limit, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = {endpoint: EndpointStats() for endpoint in ENDPOINT_URLS}
+        self.stats_lock = threading.Lock()
+        self.recorder = recorder
+        self.breakers = {endpoint: CircuitBreaker(endpoint, **(breaker_options or {})) for endpoint in ENDPOINT_URLS}
+
+    def set_rate_limit(self, rate_limit, burst=None):
+        """Resize the token bucket, e.g. to the project's quota; `burst` defaults to the current burst."""
+        self.rate_limiter = TokenBucket(rate_limit, self.rate_limiter.capacity if burst is None else burst)
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _record(self, endpoint, latency, ok, retried=False):
+        with self.stats_lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+            if retried:
+                stats.retries += 1
+            else:
+                stats.record(latency, ok)
+        record_api_call(endpoint, latency, ok, retried)
+
+    def get(self, endpoint, params=None):
+        """
+        Send a GET request to the named endpoint.
+        Returns the final response, or None if the request could not be completed.
+        """
+        url = ENDPOINT_URLS[endpoint]
+        timeout = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        breaker = self.breakers[endpoint]
+        if not breaker.allow():
+            record_short_circuit(endpoint)
+            return None
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                latency = time.monotonic() - start
+                if attempt == self.max_retries:
+                    self._record(endpoint, latency, ok=False)
+                    breaker.record_failure()
+                    print(f"An error occurred calling the {endpoint} API: {e}")
+                    return None
+            else:
+                latency = time.monotonic() - start
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    self._record(endpoint, latency, ok=response.status_code == 200)
+                    # Only a 2xx answer proves the endpoint is usable; a 403 REQUEST_DENIED is not a success.
+                    if 200 <= response.status_code < 300 and QUOTA_ERROR_MARKER not in response.content:
+                        breaker.record_success()
+                    else:
+                        breaker.record_failure()
+                    if self.recorder is not None:
+                        self.recorder.record(endpoint, params, response, latency)
+                    return response
+
+            self._record(endpoint, latency, ok=False, retried=True)
+            time.sleep(self._backoff(attempt))
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = {endpoint: stats.as_dict() for endpoint, stats in self.stats.items()}
+        for endpoint, breaker in self.breakers.items():
+            stats.setdefault(endpoint, EndpointStats().as_dict())["breaker"] = breaker.state
+        return stats
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide MapsClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                recorder = None
+                if CAPTURE_PATH:
+                    from api_capture import CaptureLog
+                    recorder = CaptureLog(CAPTURE_PATH)
+                _client = MapsClient(rate_limit=RATE_LIMIT, burst=BURST, recorder=recorder)
+    return _client
+
+
+def set_client(client):
+    """Replace the process-wide client, e.g. with an api_capture.ReplayClient."""
+    global _client
+    with _client_lock:
+        _client = client
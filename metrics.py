@@ -0,0 +1,232 @@
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DRIFT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+METRICS_PORT = os.getenv("ITMS_METRICS_PORT")
+METRICS_FILE = os.getenv("ITMS_METRICS_FILE")
+METRICS_FILE_INTERVAL = 15
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + list(extra or ())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [bucket counts..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def summary(self, **labels):
+        """Return (count, sum) for one label set."""
+        with self.lock:
+            series = self.series.get(tuple(sorted(labels.items())))
+            return (series[-2], series[-1]) if series else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', '+Inf')])} {series[-2]}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series[-2]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, *args):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help_text, *args)
+            return self.metrics[name]
+
+    def counter(self, name, help_text):
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram("itms_stage_seconds", "Time spent in each controller stage.")
+API_REQUEST_SECONDS = REGISTRY.histogram("itms_api_request_seconds", "Google Maps API request latency.")
+API_REQUESTS = REGISTRY.counter("itms_api_requests_total", "Google Maps API requests by endpoint and outcome.")
+API_RETRIES = REGISTRY.counter("itms_api_retries_total", "Google Maps API requests that were retried.")
+API_SHORT_CIRCUITS = REGISTRY.counter("itms_api_short_circuited_total",
+                                      "Requests refused because the endpoint's circuit breaker was open.")
+DEGRADED_CYCLES = REGISTRY.counter("itms_degraded_cycles_total",
+                                   "Cycles planned on fallback data, by fallback used.")
+PHASE_DRIFT_SECONDS = REGISTRY.histogram("itms_phase_drift_seconds",
+                                         "Delay between the scheduled and the actual phase change.", DRIFT_BUCKETS)
+PHASE_TRANSITIONS = REGISTRY.counter("itms_phase_transitions_total", "Signal phase changes by colour.")
+CACHE_LOOKUPS = REGISTRY.counter("itms_cache_lookups_total", "Road cache lookups by endpoint and result.")
+
+
+class timed:
+    """
+    Time a stage into itms_stage_seconds{stage=...}.
+    Works as a decorator (@timed("naming")) or a context manager (with timed("naming"): ...).
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, stage=self.stage)
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage=self.stage)
+        return wrapper
+
+
+def record_api_call(endpoint, latency, ok, retried=False):
+    if retried:
+        API_RETRIES.inc(endpoint=endpoint)
+        return
+    API_REQUEST_SECONDS.observe(latency, endpoint=endpoint)
+    API_REQUESTS.inc(endpoint=endpoint, outcome="ok" if ok else "error")
+
+
+def record_short_circuit(endpoint):
+    API_SHORT_CIRCUITS.inc(endpoint=endpoint)
+
+
+def record_cache_lookup(endpoint, hit):
+    CACHE_LOOKUPS.inc(endpoint=endpoint, result="hit" if hit else "miss")
+
+
+def record_degraded_cycle(fallback):
+    DEGRADED_CYCLES.inc(fallback=fallback)
+
+
+def record_phase_event(event):
+    PHASE_DRIFT_SECONDS.observe(max(event.drift, 0.0))
+    PHASE_TRANSITIONS.inc(color=event.color)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="0.0.0.0"):
+    """Serve the metrics at http://host:port/metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def write_metrics_file(path):
+    """Atomically replace `path` with the current metrics."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        file.write(REGISTRY.render())
+    os.replace(temp_path, path)
+
+
+def start_file_writer(path, interval=METRICS_FILE_INTERVAL):
+    """Rewrite the metrics file every `interval` seconds from a daemon thread."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_metrics_file(path)
+            except OSError as e:
+                print(f"Error writing metrics file {path}: {e}")
+
+    thread = threading.Thread(target=loop, name="metrics-file", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_exporters(port=METRICS_PORT, path=METRICS_FILE):
+    """Start the HTTP endpoint and/or the periodic file, as configured (ITMS_METRICS_PORT, ITMS_METRICS_FILE)."""
+    if port:
+        start_http_server(int(port))
+        print(f"Serving metrics on port {port}")
+    if path:
+        start_file_writer(path)
+        print(f"Writing metrics to {path} every {METRICS_FILE_INTERVAL} seconds")
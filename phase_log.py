@@ -0,0 +1,270 @@
+import argparse
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+# One fixed-size 32 byte record per phase change, intensity sample or cycle end.
+RECORD_DTYPE = np.dtype([
+    ("time", "<f8"),        # wall-clock time of the event
+    ("scheduled", "<f8"),   # wall-clock time it was scheduled for
+    ("junction", "<u4"),    # index into the log's junction table
+    ("cycle", "<u4"),
+    ("value", "<f4"),       # phase duration (green/yellow) or intensity (sample)
+    ("road", "<u2"),
+    ("kind", "u1"),
+    ("flags", "u1"),
+])
+
+KIND_RED, KIND_GREEN, KIND_YELLOW, KIND_SAMPLE, KIND_CYCLE = range(5)
+PHASE_KINDS = {"red": KIND_RED, "green": KIND_GREEN, "yellow": KIND_YELLOW}
+# Flags of a KIND_CYCLE record.
+FLAG_MISSED_REFRESH = 1
+
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+# Segments the daemon keeps by default: 1 GiB, over a month of history for 50 four-way junctions.
+DEFAULT_MAX_SEGMENTS = 16
+FLUSH_EVERY = 1024
+FLUSH_SECONDS = 10
+JUNCTION_TABLE = "junctions.json"
+
+
+class PhaseLog:
+    """
+    Append-only log of every phase change, intensity sample and cycle end, as packed
+    RECORD_DTYPE rows in segment files (`phase-<start>.bin`) that rotate once they reach
+    `max_segment_bytes`; the oldest are deleted beyond `max_segments`. Junction ids are
+    stored once in junctions.json and referenced by index.
+    Subscribe the log as a phase observer and pass `log.record_cycle` to subscribe_cycles().
+    Event times come from the controllers' scheduler clock; `clock_offset` converts them to
+    wall-clock time and defaults to the offset of time.monotonic.
+    """
+
+    def __init__(self, directory, clock_offset=None, max_segment_bytes=SEGMENT_MAX_BYTES, max_segments=None,
+                 flush_every=FLUSH_EVERY, flush_seconds=FLUSH_SECONDS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.clock_offset = time.time() - time.monotonic() if clock_offset is None else clock_offset
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segments = max_segments
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.junction_ids = load_junction_table(directory)
+        self.junction_index = {junction_id: i for i, junction_id in enumerate(self.junction_ids)}
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.segment_path = None
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _junction(self, junction_id):
+        junction_id = str(junction_id)
+        index = self.junction_index.get(junction_id)
+        if index is None:
+            index = self.junction_index[junction_id] = len(self.junction_ids)
+            self.junction_ids.append(junction_id)
+            temp_path = os.path.join(self.directory, JUNCTION_TABLE + ".tmp")
+            with open(temp_path, "w") as file:
+                json.dump(self.junction_ids, file)
+            os.replace(temp_path, os.path.join(self.directory, JUNCTION_TABLE))
+        return index
+
+    def _append(self, records):
+        with self.lock:
+            self.pending.extend(records)
+            if len(self.pending) >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_seconds:
+                self._flush()
+
+    def __call__(self, event):
+        """Phase observer."""
+        duration = event.end_time - event.scheduled_time if event.end_time is not None else 0.0
+        with self.lock:
+            junction = self._junction(event.junction_id)
+        self._append([(event.actual_time + self.clock_offset, event.scheduled_time + self.clock_offset, junction,
+                       0, duration, event.road_index, PHASE_KINDS[event.color], 0)])
+
+    def record_cycle(self, event):
+        """Cycle observer: one record for the cycle end plus one per live intensity sample."""
+        actual = event.actual_time + self.clock_offset
+        scheduled = event.scheduled_time + self.clock_offset
+        with self.lock:
+            junction = self._junction(event.junction_id)
+        records = [(actual, scheduled, junction, event.cycle, 0.0, 0, KIND_CYCLE,
+                    FLAG_MISSED_REFRESH if event.missed else 0)]
+        records.extend((actual, scheduled, junction, event.cycle, value, road, KIND_SAMPLE, 0)
+                       for road, value in event.samples.items() if value is not None)
+        self._append(records)
+
+    def _prune(self):
+        """Delete the oldest segments beyond max_segments, counting the one being written."""
+        segments = list_segments(self.directory)
+        for path in segments[:max(0, len(segments) - self.max_segments)]:
+            os.remove(path)
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        rotated = self.segment_path is None or (os.path.exists(self.segment_path)
+                                                and os.path.getsize(self.segment_path) >= self.max_segment_bytes)
+        if rotated:
+            self.segment_path = os.path.join(self.directory, f"phase-{time.time():.6f}.bin")
+        with open(self.segment_path, "ab") as file:
+            np.array(self.pending, dtype=RECORD_DTYPE).tofile(file)
+        self.pending = []
+        # Prune only once the new segment exists, so it is counted against max_segments.
+        if rotated and self.max_segments is not None:
+            self._prune()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+
+def load_junction_table(directory):
+    path = os.path.join(directory, JUNCTION_TABLE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return json.load(file)
+
+
+def list_segments(directory):
+    """Segment files of a log directory, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, "phase-*.bin")),
+                  key=lambda path: float(os.path.basename(path)[6:-4]))
+
+
+class PhaseLogReader:
+    """
+    Queries over a PhaseLog directory. Every segment is memory-mapped and reduced with NumPy
+    one at a time, so months of data are scanned without loading them into memory.
+    Hours are local time unless a `utc_offset` (seconds) is given.
+    """
+
+    def __init__(self, directory, utc_offset=None):
+        self.directory = directory
+        self.junction_ids = load_junction_table(directory)
+        self.utc_offset = time.localtime().tm_gmtoff if utc_offset is None else utc_offset
+
+    def segments(self, start=None, end=None):
+        """Yield the records of every segment, restricted to start <= time < end."""
+        for path in list_segments(self.directory):
+            if os.path.getsize(path) < RECORD_DTYPE.itemsize:
+                continue
+            records = np.memmap(path, dtype=RECORD_DTYPE, mode="r")
+            if start is not None or end is not None:
+                times = records["time"]
+                mask = np.ones(len(records), dtype=bool)
+                if start is not None:
+                    mask &= times >= start
+                if end is not None:
+                    mask &= times < end
+                records = records[mask]
+            yield records
+
+    def _junction_filter(self, records, junction_id):
+        if junction_id is None:
+            return records
+        if str(junction_id) not in self.junction_ids:
+            return records[:0]
+        return records[records["junction"] == self.junction_ids.index(str(junction_id))]
+
+    def average_green_by_hour(self, junction_id=None, start=None, end=None):
+        """
+        Average green time (s) per approach per hour of day.
+        Returns {(junction_id, road_index, hour): seconds}.
+        """
+        roads = 1 << 16
+        sums = {}
+        counts = {}
+        for records in self.segments(start, end):
+            greens = self._junction_filter(records[records["kind"] == KIND_GREEN], junction_id)
+            if not len(greens):
+                continue
+            hours = ((greens["time"] + self.utc_offset) // 3600 % 24).astype(np.int64)
+            keys = (greens["junction"].astype(np.int64) * roads + greens["road"]) * 24 + hours
+            unique, inverse = np.unique(keys, return_inverse=True)
+            segment_sums = np.bincount(inverse, weights=greens["value"])
+            segment_counts = np.bincount(inverse)
+            for key, total, count in zip(unique.tolist(), segment_sums.tolist(), segment_counts.tolist()):
+                sums[key] = sums.get(key, 0.0) + total
+                counts[key] = counts.get(key, 0) + count
+        result = {}
+        for key, total in sorted(sums.items()):
+            junction, rest = divmod(key, roads * 24)
+            road, hour = divmod(rest, 24)
+            result[(self.junction_ids[junction], road, hour)] = total / counts[key]
+        return result
+
+    def missed_refreshes(self, junction_id=None, start=None, end=None):
+        """Cycles whose refresh missed the deadline, as a list of (time, junction_id, cycle)."""
+        missed = []
+        for records in self.segments(start, end):
+            cycles = records[(records["kind"] == KIND_CYCLE) & (records["flags"] & FLAG_MISSED_REFRESH > 0)]
+            cycles = self._junction_filter(cycles, junction_id)
+            missed.extend((float(t), self.junction_ids[j], int(c))
+                          for t, j, c in zip(cycles["time"], cycles["junction"], cycles["cycle"]))
+        return missed
+
+    def intensity_samples(self, junction_id, road_index, start=None, end=None):
+        """(times, intensities) arrays of the live samples of one approach."""
+        times = []
+        values = []
+        for records in self.segments(start, end):
+            samples = self._junction_filter(records[records["kind"] == KIND_SAMPLE], junction_id)
+            samples = samples[samples["road"] == road_index]
+            times.append(np.asarray(samples["time"]))
+            values.append(np.asarray(samples["value"]))
+        if not times:
+            return np.array([]), np.array([])
+        return np.concatenate(times), np.concatenate(values)
+
+    def drift_summary(self, start=None, end=None):
+        """Count, mean and maximum drift (s) between scheduled and actual phase changes."""
+        count = 0
+        total = 0.0
+        worst = 0.0
+        for records in self.segments(start, end):
+            phases = records[records["kind"] <= KIND_YELLOW]
+            if not len(phases):
+                continue
+            drift = phases["time"] - phases["scheduled"]
+            count += len(drift)
+            total += float(drift.sum())
+            worst = max(worst, float(drift.max()))
+        return {"count": count, "mean": total / count if count else 0.0, "max": worst}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a phase log.")
+    parser.add_argument("directory", help="phase log directory")
+    parser.add_argument("--junction", help="only this junction")
+    args = parser.parse_args()
+
+    reader = PhaseLogReader(args.directory)
+    started = time.perf_counter()
+    greens = reader.average_green_by_hour(args.junction)
+    missed = reader.missed_refreshes(args.junction)
+    drift = reader.drift_summary()
+    elapsed = time.perf_counter() - started
+
+    print(f"{'Junction':<16}{'Road':>6}{'Hour':>6}{'Avg green (s)':>16}")
+    for (junction_id, road, hour), green in greens.items():
+        print(f"{junction_id:<16}{road:>6}{hour:>6}{green:>16.1f}")
+    print(f"\n{len(missed)} cycles missed their refresh deadline")
+    print(f"Phase drift: mean {drift['mean'] * 1000:.2f} ms, max {drift['max'] * 1000:.2f} ms "
+          f"over {drift['count']} phase changes")
+    print(f"Queried in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+from abc import ABC, abstractmethod
+
+
+MIN_GREEN_SECONDS = 7
+MAX_GREEN_SECONDS = 90
+# Start-up and clearance time lost at every phase change, taken out of the cycle before splitting it.
+LOST_TIME_PER_PHASE = 2.0
+
+
+def busiest_first(intensities):
+    return sorted(range(len(intensities)), key=lambda i: intensities[i], reverse=True)
+
+
+class PhaseTiming(ABC):
+    """Turns approach intensities into a signal plan: a list of (road_index, green_seconds)."""
+
+    @abstractmethod
+    def plan(self, intensities, life_cycle_seconds):
+        """Return the plan for one cycle of `life_cycle_seconds`."""
+
+
+class HalfCycleTiming(PhaseTiming):
+    """
+    The original split: the busiest road gets half of the cycle and the remaining
+    half is split equally between the other roads. A lone road gets the whole cycle.
+    """
+
+    def plan(self, intensities, life_cycle_seconds):
+        sorted_indices = busiest_first(intensities)
+        if len(sorted_indices) == 1:
+            return [(sorted_indices[0], life_cycle_seconds)]
+        half_cycle_time = life_cycle_seconds / 2
+        secondary_cycle_time = half_cycle_time / (len(sorted_indices) - 1)
+        return [(road_index, half_cycle_time if index == 0 else secondary_cycle_time)
+                for index, road_index in enumerate(sorted_indices)]
+
+
+class ProportionalTiming(PhaseTiming):
+    """
+    Webster-style split: after taking `lost_time_per_phase` out of the cycle for every phase,
+    the effective green is shared in proportion to each approach's intensity, then clamped
+    to [min_green, max_green] with the remainder redistributed among the unclamped approaches.
+    Roads are served busiest first.
+    """
+
+    def __init__(self, min_green=MIN_GREEN_SECONDS, max_green=MAX_GREEN_SECONDS,
+                 lost_time_per_phase=LOST_TIME_PER_PHASE):
+        if min_green > max_green:
+            raise ValueError("min_green must not be greater than max_green")
+        self.min_green = min_green
+        self.max_green = max_green
+        self.lost_time_per_phase = lost_time_per_phase
+
+    def split(self, intensities, life_cycle_seconds):
+        """Return the green time of every approach, in approach order."""
+        count = len(intensities)
+        if count == 0:
+            return []
+        effective_green = max(0.0, life_cycle_seconds - count * self.lost_time_per_phase)
+        if count * self.min_green >= effective_green:
+            # Not even the minimum greens fit: serve every approach equally.
+            return [effective_green / count] * count
+
+        weights = [max(float(intensity or 0), 0.0) for intensity in intensities]
+        if sum(weights) == 0:
+            weights = [1.0] * count
+
+        greens = [None] * count
+        remaining = effective_green
+        free = set(range(count))
+        # Water-filling: clamp the approaches on the side of the limits that is violated by more
+        # seconds in total (those are certain to end up on their limit), re-split what is left among
+        # the others, and repeat until every share fits.
+        while free:
+            if remaining <= len(free) * self.min_green:
+                for i in free:
+                    greens[i] = remaining / len(free)
+                break
+            total_weight = sum(weights[i] for i in free)
+            shares = {i: remaining * weights[i] / total_weight if total_weight else remaining / len(free)
+                      for i in free}
+            excess = sum(share - self.max_green for share in shares.values() if share > self.max_green)
+            deficit = sum(self.min_green - share for share in shares.values() if share < self.min_green)
+            clamped = {}
+            if excess >= deficit:
+                clamped.update((i, self.max_green) for i, share in shares.items() if share > self.max_green)
+            if deficit >= excess:
+                clamped.update((i, self.min_green) for i, share in shares.items() if share < self.min_green)
+            if not clamped:
+                for i, share in shares.items():
+                    greens[i] = share
+                break
+            for i, green in clamped.items():
+                greens[i] = green
+                remaining -= green
+                free.discard(i)
+        return greens
+
+    def plan(self, intensities, life_cycle_seconds):
+        greens = self.split(intensities, life_cycle_seconds)
+        return [(road_index, greens[road_index]) for road_index in busiest_first(intensities)]
+
+
+TIMING_ENGINES = {
+    "half-cycle": HalfCycleTiming,
+    "proportional": ProportionalTiming,
+}
+DEFAULT_TIMING = "proportional"
+
+
+def make_timing(name=DEFAULT_TIMING, **options):
+    """Build a timing engine by name, e.g. make_timing("proportional", min_green=10)."""
+    if name not in TIMING_ENGINES:
+        raise ValueError(f"Unknown phase timing '{name}', choose from: {', '.join(TIMING_ENGINES)}")
+    return TIMING_ENGINES[name](**options)
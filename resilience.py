@@ -0,0 +1,135 @@
+import threading
+import time
+
+import numpy as np
+
+
+# Consecutive failures that open a breaker, and seconds before it lets a trial request through.
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+# Width of a fallback profile bin, and how long the last good intensities stay usable.
+FALLBACK_BIN_SECONDS = 60 * 60
+LAST_GOOD_MAX_AGE = 15 * 60
+FALLBACK_ALPHA = 0.3
+DAY_SECONDS = 24 * 60 * 60
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker.
+    Closed: requests pass. After `failure_threshold` consecutive failures it opens and requests
+    are refused without touching the network. After `reset_timeout` seconds it is half-open:
+    one trial request passes, and its outcome closes or re-opens the breaker.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_SECONDS,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """True if a request may be sent now."""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                print(f"{self.name} API recovered, closing its circuit breaker.")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                if self.state == self.CLOSED:
+                    print(f"{self.name} API failed {self.failures} times in a row, opening its circuit breaker "
+                          f"for {self.reset_timeout:.0f} seconds.")
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+
+class FallbackPlans:
+    """
+    Degraded-mode plans for one junction.
+    Every good set of intensities is folded into an hour-of-day profile and, while it is at hand,
+    the plans for the last good intensities and for that profile bin are computed. Switching to a
+    fallback therefore never waits on the API or on the timing engine: plan_for() is a lookup.
+    Until a bin has been seen, it falls back to the plan for the last good intensities, which is
+    pre-warmed from the junction's initial intensities.
+    """
+
+    def __init__(self, timing, life_cycle_seconds, intensities, bin_seconds=FALLBACK_BIN_SECONDS,
+                 max_age=LAST_GOOD_MAX_AGE, alpha=FALLBACK_ALPHA, utc_offset=0):
+        self.timing = timing
+        self.life_cycle_seconds = life_cycle_seconds
+        self.bin_seconds = bin_seconds
+        self.max_age = max_age
+        self.alpha = alpha
+        self.utc_offset = utc_offset
+        bins = -(-DAY_SECONDS // bin_seconds)
+        self.profile = np.zeros((bins, len(intensities)))
+        self.seen = np.zeros(bins, dtype=bool)
+        self.plans = [None] * bins
+        self.last_good = [float(intensity or 0) for intensity in intensities]
+        self.last_good_time = None
+        self.last_good_plan = timing.plan(self.last_good, life_cycle_seconds)
+
+    def _bin(self, t):
+        return int(((t + self.utc_offset) % DAY_SECONDS) // self.bin_seconds)
+
+    def record(self, t, intensities):
+        """Fold a complete, good set of intensities measured at `t` into the fallbacks."""
+        values = np.array([float(intensity) for intensity in intensities])
+        time_bin = self._bin(t)
+        if self.seen[time_bin]:
+            self.profile[time_bin] += self.alpha * (values - self.profile[time_bin])
+        else:
+            self.profile[time_bin] = values
+            self.seen[time_bin] = True
+        self.plans[time_bin] = self.timing.plan(self.profile[time_bin].tolist(), self.life_cycle_seconds)
+        self.last_good = values.tolist()
+        self.last_good_time = t
+        self.last_good_plan = self.timing.plan(self.last_good, self.life_cycle_seconds)
+
+    def last_good_is_fresh(self, t):
+        return self.last_good_time is not None and t - self.last_good_time <= self.max_age
+
+    def intensities_for(self, t):
+        """Best available intensities at `t`: the last good ones while fresh, then the time-of-day profile."""
+        time_bin = self._bin(t)
+        if not self.last_good_is_fresh(t) and self.seen[time_bin]:
+            return self.profile[time_bin].tolist()
+        return list(self.last_good)
+
+    def plan_for(self, t):
+        """Pre-computed plan for `t`, matching intensities_for(t)."""
+        time_bin = self._bin(t)
+        if not self.last_good_is_fresh(t) and self.seen[time_bin]:
+            return self.plans[time_bin]
+        return self.last_good_plan
+
+    def fill(self, t, intensities):
+        """Replace missing (None) intensities with the fallback values for `t`."""
+        fallback = self.intensities_for(t)
+        return [round(fallback[i]) if intensity is None else intensity for i, intensity in enumerate(intensities)]
@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import record_cache_lookup
+
+
+DEFAULT_CACHE_PATH = os.getenv("ITMS_CACHE_PATH", "itms_cache.sqlite3")
+# While API responses are captured (ITMS_CAPTURE_PATH, see api_capture.py) every lookup has to reach
+# the API to be recorded, so the process starts from an empty in-memory cache instead.
+CAPTURING = bool(os.getenv("ITMS_CAPTURE_PATH"))
+
+# Road geometry and names almost never change, business listings change more often.
+DAY = 24 * 60 * 60
+ENDPOINT_TTLS = {
+    "roads": 30 * DAY,
+    "discovery": 30 * DAY,
+    "road_name": 30 * DAY,
+    "place_name": 30 * DAY,
+    "places": 7 * DAY,
+}
+DEFAULT_TTL = 7 * DAY
+
+# 5 decimal places is roughly 1 metre, well inside the accuracy of a snapped point.
+COORDINATE_PRECISION = 5
+DEFAULT_MAX_ENTRIES = 100000
+# Last-access times of hits are written in one transaction once this many are pending or they are this old.
+ACCESS_FLUSH_ENTRIES = 256
+ACCESS_FLUSH_SECONDS = 60
+
+
+class RoadCache:
+    """
+    Persistent SQLite cache for Roads, Geocoding and Places results.
+    Entries are keyed by endpoint and quantized coordinates, expire after a per-endpoint TTL
+    and are evicted least-recently-used first once the cache grows past `max_entries`.
+    Hits are counted in itms_cache_lookups_total, and their last-access times are batched
+    rather than written one transaction per hit.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttls=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttls = dict(ENDPOINT_TTLS, **(ttls or {}))
+        self.hits = {}
+        self.misses = {}
+        self.pending_access = {}
+        self.last_access_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "endpoint TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "created REAL NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (endpoint, key))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+        self.connection.commit()
+        # Upper bound of the row count (a replaced entry is counted again); recounted before evicting.
+        self.entries = self.connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    @staticmethod
+    def make_key(latitude, longitude, *extra):
+        """Build a cache key from quantized coordinates plus any extra parameters."""
+        parts = [f"{latitude:.{COORDINATE_PRECISION}f}", f"{longitude:.{COORDINATE_PRECISION}f}"]
+        parts.extend(str(value) for value in extra)
+        return ",".join(parts)
+
+    def get(self, endpoint, key):
+        """Return the cached value, or None if it is missing or expired."""
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, created FROM cache WHERE endpoint = ? AND key = ?", (endpoint, key)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttls.get(endpoint, DEFAULT_TTL):
+                if row is not None:
+                    self.connection.execute("DELETE FROM cache WHERE endpoint = ? AND key = ?", (endpoint, key))
+                    self.connection.commit()
+                self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+                record_cache_lookup(endpoint, hit=False)
+                return None
+            self.pending_access[(endpoint, key)] = now
+            if (len(self.pending_access) >= ACCESS_FLUSH_ENTRIES
+                    or time.monotonic() - self.last_access_flush >= ACCESS_FLUSH_SECONDS):
+                self._flush_access()
+                self.connection.commit()
+            self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+        record_cache_lookup(endpoint, hit=True)
+        return json.loads(row[0])
+
+    def put(self, endpoint, key, value):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (endpoint, key, value, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (endpoint, key, json.dumps(value), now, now)
+            )
+            self.pending_access.pop((endpoint, key), None)
+            self.entries += 1
+            if self.entries > self.max_entries:
+                self._flush_access()
+                self._evict()
+            self.connection.commit()
+
+    def _flush_access(self):
+        """Write the batched last-access times of recent hits; the caller commits."""
+        if self.pending_access:
+            self.connection.executemany(
+                "UPDATE cache SET last_access = ? WHERE endpoint = ? AND key = ?",
+                [(last_access, endpoint, key) for (endpoint, key), last_access in self.pending_access.items()]
+            )
+            self.pending_access = {}
+        self.last_access_flush = time.monotonic()
+
+    def _evict(self):
+        count = self.entries = self.connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count > self.max_entries:
+            # Evict down to 90% of the limit so we do not evict on every insert.
+            excess = count - int(self.max_entries * 0.9)
+            self.connection.execute(
+                "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY last_access LIMIT ?)",
+                (excess,)
+            )
+            self.entries -= excess
+
+    def clear(self, endpoint=None):
+        with self.lock:
+            if endpoint is None:
+                self.connection.execute("DELETE FROM cache")
+                self.pending_access = {}
+            else:
+                self.connection.execute("DELETE FROM cache WHERE endpoint = ?", (endpoint,))
+            self.connection.commit()
+
+    def get_stats(self):
+        """Return hit/miss counts and the number of stored entries for every endpoint."""
+        with self.lock:
+            sizes = dict(self.connection.execute("SELECT endpoint, COUNT(*) FROM cache GROUP BY endpoint"))
+            endpoints = set(sizes) | set(self.hits) | set(self.misses)
+            return {
+                endpoint: {
+                    "hits": self.hits.get(endpoint, 0),
+                    "misses": self.misses.get(endpoint, 0),
+                    "entries": sizes.get(endpoint, 0),
+                }
+                for endpoint in endpoints
+            }
+
+    def close(self):
+        with self.lock:
+            self._flush_access()
+            self.connection.commit()
+            self.connection.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide RoadCache, opening it on first use (in memory while capturing)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RoadCache(":memory:" if CAPTURING else DEFAULT_CACHE_PATH)
+    return _cache
+
+
+def set_cache(cache):
+    """Replace the process-wide cache, e.g. with a RoadCache(":memory:") for a load test."""
+    global _cache
+    with _cache_lock:
+        _cache = cache
@@ -0,0 +1,490 @@
+import heapq
+import itertools
+import threading
+import time
+
+from junction_state import JunctionState
+from metrics import record_degraded_cycle, record_phase_event, timed
+from phase_timing import make_timing
+
+
+YELLOW_SECONDS = 5
+# Pause between the end of one cycle and the start of the next.
+CYCLE_GAP_SECONDS = 1
+
+
+class SimulationClock:
+    """
+    A manually advanced clock for running controllers faster than real time.
+    Pass it to a Scheduler and drive the scheduler with run_until().
+    """
+
+    def __init__(self, start=0.0):
+        self.time = start
+
+    def __call__(self):
+        return self.time
+
+    def advance_to(self, deadline):
+        self.time = max(self.time, deadline)
+
+
+class Scheduler:
+    """
+    Runs callbacks at monotonic deadlines from a single event queue.
+    One scheduler can drive the phase transitions of any number of junctions.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def now(self):
+        return self.clock()
+
+    def call_at(self, deadline, callback, *args):
+        """Run `callback(*args)` once the clock reaches `deadline`. Returns a handle for cancel()."""
+        entry = [deadline, next(self._counter), callback, args, False]
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            self._condition.notify()
+        return entry
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.now() + delay, callback, *args)
+
+    @staticmethod
+    def cancel(entry):
+        entry[4] = True
+
+    def _next_due(self):
+        """Wait for the earliest due entry and pop it, or return None once stopped."""
+        with self._condition:
+            while self._running:
+                if not self._queue:
+                    self._condition.wait()
+                    continue
+                delay = self._queue[0][0] - self.now()
+                if delay <= 0:
+                    return heapq.heappop(self._queue)
+                self._condition.wait(delay)
+            return None
+
+    def run(self):
+        """Process events until stop() is called."""
+        self._running = True
+        while True:
+            entry = self._next_due()
+            if entry is None:
+                return
+            deadline, _, callback, args, cancelled = entry
+            if cancelled:
+                continue
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error in scheduled callback {getattr(callback, '__name__', callback)}: {e}")
+
+    def run_until(self, end_time, speed=None):
+        """
+        Process every event due before `end_time` on a SimulationClock, jumping the clock from
+        one deadline to the next. With `speed` set, waits (deadline gap / speed) real seconds
+        between events instead, e.g. speed=60 runs one simulated minute per second.
+        """
+        while True:
+            with self._condition:
+                if not self._queue or self._queue[0][0] > end_time:
+                    break
+                entry = heapq.heappop(self._queue)
+            deadline, _, callback, args, cancelled = entry
+            if cancelled:
+                continue
+            if speed is not None and deadline > self.now():
+                time.sleep((deadline - self.now()) / speed)
+            self.clock.advance_to(deadline)
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error in scheduled callback {getattr(callback, '__name__', callback)}: {e}")
+        self.clock.advance_to(end_time)
+
+    def start(self):
+        """Run the scheduler on a background daemon thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name="signal-scheduler", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+class PhaseEvent:
+    """A single signal change published by a JunctionController."""
+
+    __slots__ = ("junction_id", "road_index", "road_name", "color", "scheduled_time", "actual_time", "end_time")
+
+    def __init__(self, junction_id, road_index, road_name, color, scheduled_time, actual_time, end_time=None):
+        self.junction_id = junction_id
+        self.road_index = road_index
+        self.road_name = road_name
+        self.color = color
+        self.scheduled_time = scheduled_time
+        self.actual_time = actual_time
+        self.end_time = end_time
+
+    @property
+    def drift(self):
+        """Seconds between the scheduled and the actual phase change."""
+        return self.actual_time - self.scheduled_time
+
+
+class CycleEvent:
+    """
+    End-of-cycle report published by a JunctionController: the live `samples` ({road_index: intensity})
+    received for this cycle's refresh, the intensities the next cycle is planned on, and whether
+    a refresh was due but did not finish before the cycle ended.
+    """
+
+    __slots__ = ("junction_id", "cycle", "scheduled_time", "actual_time", "samples", "intensities", "missed")
+
+    def __init__(self, junction_id, cycle, scheduled_time, actual_time, samples, intensities, missed):
+        self.junction_id = junction_id
+        self.cycle = cycle
+        self.scheduled_time = scheduled_time
+        self.actual_time = actual_time
+        self.samples = samples
+        self.intensities = intensities
+        self.missed = missed
+
+
+class JunctionController:
+    """
+    Drives the signal plan of one junction on a Scheduler.
+    Every phase change is published as a PhaseEvent to the subscribed observers,
+    so the controller itself never touches a GUI.
+    `fetch_intensities(previous_intensities)` is called on a worker thread during the
+    last yellow phase of each cycle and must return the intensities for the next cycle.
+    With `background_refresh=False` it is called inline instead, which keeps simulations deterministic.
+    `timing` is the PhaseTiming engine that turns intensities into green times.
+    With an IntensityTracker as `tracker`, only the approaches it marks as due are polled, via
+    `fetch_intensities(previous_intensities, indices)`, and the plan is only recomputed once the
+    smoothed intensities have changed enough.
+    A CorridorCoordinator can lock the cycle to a corridor with coordinate(), holding each cycle
+    start so the coordinated approach turns green at its green-wave offset.
+    With a FallbackPlans as `fallback`, approaches whose refresh failed are reported as None instead
+    of keeping their previous value: a partial failure is filled from the fallback, and a failed
+    refresh switches to the last good plan, or to the time-of-day plan once that is stale.
+    Intensities and planned greens are kept in the `state` rows (a JunctionState) of the junction's
+    ApproachTable, so the table is always current; without one the controller keeps its own.
+    When `fetch_intensities` does not return live values (a ForecastingSource forecast), pass
+    `samples()` returning (live samples {road_index: intensity} since the last call, True if a poll
+    was missed); the CycleEvent then reports those instead of the planned-on values.
+    """
+
+    def __init__(self, junction_id, road_names, scheduler, fetch_intensities, life_cycle_seconds,
+                 intensities=None, yellow_seconds=YELLOW_SECONDS, cycle_gap_seconds=CYCLE_GAP_SECONDS,
+                 timing=None, tracker=None, background_refresh=True, verbose=True, fallback=None,
+                 state=None, samples=None):
+        self.junction_id = junction_id
+        self.road_names = list(road_names)
+        self.scheduler = scheduler
+        self.fetch_intensities = fetch_intensities
+        self.life_cycle_seconds = life_cycle_seconds
+        self.yellow_seconds = yellow_seconds
+        self.cycle_gap_seconds = cycle_gap_seconds
+        self.timing = timing or make_timing()
+        self.tracker = tracker
+        self.fallback = fallback
+        self.samples = samples
+        self.background_refresh = background_refresh
+        self.verbose = verbose
+        self.state = state if state is not None else JunctionState.standalone(len(self.road_names))
+        if intensities is not None:
+            self.intensities = intensities
+        self.observers = []
+        self.cycle_observers = []
+        self.plan = []
+        self.cycle_count = 0
+        self.running = False
+        self._plan_dirty = True
+        # Set while running on a fallback plan, so the first good refresh replans.
+        self._degraded = False
+        self._polled_indices = None
+        self._refresh_result = None
+        self._refresh_thread = None
+        self.coordination = None
+        # Greens are multiplied by this to fill a corridor's common cycle (see _coordinated_start).
+        self._green_stretch = 1.0
+
+    @property
+    def intensities(self):
+        """The intensity of every approach, read from the junction's table rows."""
+        return [round(intensity) for intensity in self.state.intensities.tolist()]
+
+    @intensities.setter
+    def intensities(self, intensities):
+        self.state.intensities[:] = intensities
+
+    @property
+    def plan(self):
+        return self._plan
+
+    @plan.setter
+    def plan(self, plan):
+        """Adopt a plan [(road_index, green_seconds)], recording its greens in the table rows."""
+        self._plan = plan
+        greens = self.state.greens
+        for road_index, green in plan:
+            greens[road_index] = green
+
+    def subscribe(self, observer):
+        """Register `observer(event)` to be called for every PhaseEvent."""
+        self.observers.append(observer)
+
+    def subscribe_cycles(self, observer):
+        """Register `observer(event)` to be called with a CycleEvent at the end of every cycle."""
+        self.cycle_observers.append(observer)
+
+    def start(self, delay=0.0):
+        self.running = True
+        start_time = self.scheduler.now() + delay
+        self.scheduler.call_at(start_time, self._start_cycle, start_time)
+
+    def stop(self):
+        self.running = False
+
+    def coordinate(self, cycle_seconds, offset=0.0, road_index=0, reference_time=0.0):
+        """
+        Hold every cycle start so `road_index` turns green at reference_time + offset + k * cycle_seconds.
+        Pass cycle_seconds=None to run uncoordinated again.
+        """
+        if cycle_seconds is None:
+            self.coordination = None
+            self._green_stretch = 1.0
+        else:
+            self.coordination = (cycle_seconds, offset, road_index, reference_time)
+
+    def natural_cycle_seconds(self):
+        """Length of one cycle of the current plan: greens, yellows and the gap before the next cycle."""
+        plan = self.plan or self.timing.plan(self.intensities, self.life_cycle_seconds)
+        return sum(green for _, green in plan) + len(plan) * self.yellow_seconds + self.cycle_gap_seconds
+
+    def _update_plan(self):
+        if self._plan_dirty or not self.plan:
+            with timed("plan"):
+                self.plan = self.timing.plan(self.intensities, self.life_cycle_seconds)
+            self._plan_dirty = False
+
+    def _coordinated_start(self, earliest_start):
+        """
+        The first cycle start at or after `earliest_start` at which the coordinated approach is on its offset.
+        The plan is rotated so the coordinated approach is served first; reordering the plan never moves its green.
+        A plan shorter than the common cycle has its greens stretched to fill it, rather than holding every
+        approach red for the difference; the plan itself keeps its natural greens for natural_cycle_seconds().
+        """
+        cycle_seconds, offset, road_index, reference_time = self.coordination
+        self._update_plan()
+        steps = [planned_road for planned_road, _ in self.plan]
+        if road_index in steps:
+            first = steps.index(road_index)
+            self.plan = self.plan[first:] + self.plan[:first]
+        greens = sum(green for _, green in self.plan)
+        available = cycle_seconds - len(self.plan) * self.yellow_seconds - self.cycle_gap_seconds
+        self._green_stretch = available / greens if greens > 0 and available > greens else 1.0
+        wait = (reference_time + offset - earliest_start) % cycle_seconds
+        # A wait of (almost) a whole cycle is rounding error on a cycle that is already on its offset.
+        return earliest_start + (wait if wait < cycle_seconds - 1e-6 else 0.0)
+
+    def _label(self, road_index):
+        return f"{chr(65 + road_index)} ({self.road_names[road_index]})"
+
+    def _print(self, message):
+        if self.verbose:
+            print(message)
+
+    def _emit(self, road_index, color, scheduled_time, end_time=None):
+        event = PhaseEvent(self.junction_id, road_index, self.road_names[road_index], color,
+                           scheduled_time, self.scheduler.now(), end_time)
+        record_phase_event(event)
+        with timed("phase_observers"):
+            for observer in self.observers:
+                try:
+                    observer(event)
+                except Exception as e:
+                    print(f"Error in phase observer: {e}")
+
+    def _start_cycle(self, cycle_start):
+        if not self.running:
+            return
+        self.cycle_count += 1
+        self._update_plan()
+        self._refresh_result = None
+        for road_index in range(len(self.road_names)):
+            self._emit(road_index, "red", cycle_start)
+        self._enter_green(0, cycle_start)
+
+    def _enter_green(self, step, scheduled_time):
+        road_index, green_time = self.plan[step]
+        green_time *= self._green_stretch
+        end_time = scheduled_time + green_time
+        self._print(f"{self._label(road_index)} green for {green_time:.1f} seconds.")
+        self._emit(road_index, "green", scheduled_time, end_time)
+        self.scheduler.call_at(end_time, self._enter_yellow, step, end_time)
+
+    def _enter_yellow(self, step, scheduled_time):
+        if not self.running:
+            return
+        road_index, _ = self.plan[step]
+        end_time = scheduled_time + self.yellow_seconds
+        self._print(f"{self._label(road_index)} yellow for {self.yellow_seconds} seconds.")
+        self._emit(road_index, "yellow", scheduled_time, end_time)
+
+        if step == len(self.plan) - 1:
+            self._start_refresh()
+
+        self.scheduler.call_at(end_time, self._enter_red, step, end_time)
+
+    def _enter_red(self, step, scheduled_time):
+        road_index, _ = self.plan[step]
+        self._emit(road_index, "red", scheduled_time)
+        if not self.running:
+            return
+        if step + 1 < len(self.plan):
+            self._enter_green(step + 1, scheduled_time)
+        else:
+            self._finish_cycle(scheduled_time)
+
+    def _start_refresh(self):
+        self._polled_indices = None
+        if self.tracker is not None:
+            self._polled_indices = self.tracker.due(self.cycle_count)
+            if not self._polled_indices:
+                self._print("All approaches are stable, skipping the traffic refresh this cycle.")
+                return
+
+        self._print("Fetching new traffic data during yellow light of the last road.")
+        # With a fallback, failed approaches come back as None rather than as their previous value.
+        previous = [None] * len(self.road_names) if self.fallback is not None else list(self.intensities)
+        args = (previous, self._polled_indices)
+        if self.background_refresh:
+            self._refresh_thread = threading.Thread(target=self._refresh, args=args, daemon=True)
+            self._refresh_thread.start()
+        else:
+            self._refresh(*args)
+
+    @timed("refresh")
+    def _refresh(self, previous_intensities, indices=None):
+        try:
+            if indices is None:
+                self._refresh_result = self.fetch_intensities(previous_intensities)
+            else:
+                self._refresh_result = self.fetch_intensities(previous_intensities, indices)
+        except Exception as e:
+            print(f"Error refreshing traffic data: {e}")
+
+    def _apply_refresh(self, intensities):
+        """Adopt refreshed intensities, returning True if the plan has to be recomputed."""
+        if self.tracker is None:
+            self.intensities = list(intensities)
+            return True
+        self.tracker.update(self.cycle_count, self._polled_indices, intensities)
+        # After a fallback plan the tracker's last planned intensities no longer match the plan.
+        if not self.tracker.needs_replan() and not self._degraded:
+            return False
+        self.tracker.mark_planned()
+        self.intensities = [round(intensity) for intensity in self.tracker.smoothed.tolist()]
+        return True
+
+    def _publish_cycle(self, scheduled_time, missed):
+        samples = {}
+        if self.samples is not None:
+            samples, missed_poll = self.samples()
+            missed = missed or missed_poll
+        elif self._refresh_result is not None:
+            polled = range(len(self._refresh_result)) if self._polled_indices is None else self._polled_indices
+            samples = {i: self._refresh_result[i] for i in polled}
+        event = CycleEvent(self.junction_id, self.cycle_count, scheduled_time, self.scheduler.now(), samples,
+                           list(self.intensities), missed)
+        for observer in self.cycle_observers:
+            try:
+                observer(event)
+            except Exception as e:
+                print(f"Error in cycle observer: {e}")
+
+    def _check_refresh(self, now, intensities):
+        """
+        Fill the approaches a refresh failed to poll from the fallback.
+        Returns (intensities to adopt, True if every polled approach answered); the intensities
+        are None if none of them did.
+        """
+        polled = range(len(intensities)) if self._polled_indices is None else self._polled_indices
+        failed = [i for i in polled if intensities[i] is None]
+        if not failed:
+            return intensities, True
+        if len(failed) == len(polled):
+            return None, False
+        record_degraded_cycle("partial")
+        self._print(f"\nTraffic refresh failed for {len(failed)} of {len(polled)} approaches, "
+                    f"filling them in from the fallback.")
+        if self.tracker is not None:
+            # The tracker keeps the smoothed value of a missing sample and polls it again next cycle.
+            return intensities, False
+        return self.fallback.fill(now, intensities), False
+
+    def _fall_back(self, now):
+        """Plan the next cycle on the last good intensities, or on the time-of-day profile once they are stale."""
+        fresh = self.fallback.last_good_is_fresh(now)
+        record_degraded_cycle("last_good" if fresh else "time_of_day")
+        self._print("\nTraffic refresh failed, using the "
+                    f"{'last good' if fresh else 'time-of-day'} fallback plan.")
+        self.intensities = [round(intensity) for intensity in self.fallback.intensities_for(now)]
+        self.plan = self.fallback.plan_for(now)
+        self._plan_dirty = False
+        self._degraded = True
+
+    def _finish_cycle(self, scheduled_time):
+        missed = False
+        result = self._refresh_result
+        complete = False
+        if result is not None and self.fallback is not None:
+            now = self.scheduler.now()
+            result, complete = self._check_refresh(now, result)
+            if result is None:
+                missed = True
+                self._fall_back(now)
+        if result is not None:
+            replanned = self._apply_refresh(result)
+            self._degraded = False
+            if replanned:
+                self._plan_dirty = True
+                self._print("\nNext cycle data (updated traffic intensities):")
+                for i, traffic_intensity in enumerate(self.intensities):
+                    self._print(f"{self._label(i)}: Traffic Intensity: {traffic_intensity}")
+            else:
+                self._print("\nTraffic has not changed significantly, keeping the current plan.")
+            if complete:
+                self.fallback.record(self.scheduler.now(),
+                                     self.tracker.smoothed if self.tracker is not None else self.intensities)
+        elif self._refresh_result is None and self._polled_indices != []:
+            missed = True
+            if self.fallback is not None:
+                self._fall_back(self.scheduler.now())
+            else:
+                self._print("\nTraffic refresh did not finish in time, keeping previous intensities.")
+        if self.cycle_observers:
+            self._publish_cycle(scheduled_time, missed)
+
+        self._print("\nStarting next cycle with updated traffic data.")
+        next_start = scheduled_time + self.cycle_gap_seconds
+        if self.coordination is not None:
+            next_start = self._coordinated_start(next_start)
+        self.scheduler.call_at(next_start, self._start_cycle, next_start)